@@ -0,0 +1,75 @@
+import argparse
+import csv
+import gzip
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+
+def connect_read_only(database):
+    return sqlite3.connect(Path(database).resolve().as_uri() + "?mode=ro", uri=True)
+
+
+def output_filename_for(sql_filename, output_path):
+    return Path(output_path) / Path(sql_filename).name.replace(".sql", ".csv.gz")
+
+
+def export_query(database, sql_filename, output_filename, batch_size=10_000):
+    """Execute a query file and write its result to a gzipped CSV
+
+    Runs in a worker process, with its own read-only connection; rows are
+    written as they are fetched. Returns `(rows, seconds)`.
+    """
+    start = time.perf_counter()
+    with open(sql_filename, encoding="utf-8") as fobj:
+        query = fobj.read()
+    connection = connect_read_only(database)
+    try:
+        cursor = connection.execute(query)
+        total = 0
+        with gzip.open(output_filename, mode="wt", encoding="utf-8", newline="", compresslevel=6) as fobj:
+            writer = csv.writer(fobj, lineterminator="\n")
+            writer.writerow([column[0] for column in cursor.description])
+            for batch in iter(lambda: cursor.fetchmany(batch_size), []):
+                writer.writerows(batch)
+                total += len(batch)
+    finally:
+        connection.close()
+    return total, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Execute analysis queries in parallel, exporting to .csv.gz")
+    parser.add_argument("--output-path", default="data/analysis")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("database")
+    parser.add_argument("sql_filename", nargs="+")
+    args = parser.parse_args()
+
+    output_path = Path(args.output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    filenames = [filename for filename in args.sql_filename if not filename.endswith("setup.sql")]
+    start, errors = time.perf_counter(), 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {
+            executor.submit(export_query, args.database, filename, output_filename_for(filename, output_path)): filename
+            for filename in filenames
+        }
+        for future in as_completed(futures):
+            filename = Path(futures[future]).name
+            try:
+                total, seconds = future.result()
+            except Exception as exception:
+                errors += 1
+                print(f"ERROR executing {filename}: {exception}")
+            else:
+                print(f"{filename}: {total} rows in {seconds:.3f}s")
+    print(f"Executed {len(filenames)} queries in {time.perf_counter() - start:.3f}s ({errors} errors)")
+    if errors:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
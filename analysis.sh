@@ -8,7 +8,11 @@ function create_database() {
 	database_filename="$1"; shift
 	clean="$1"
 
-	rm -rf "$database_filename"
+	# The database is kept between runs (so aggregates are refreshed
+	# incrementally): only the source tables are imported again
+	if [ "$clean" = "--clean" ]; then
+		rm -rf "$database_filename"
+	fi
 	for table in boletim caso obito_cartorio caso_full; do
 		filename="data/output/${table}.csv.gz"
 		if [ "$clean" = "--clean" ]; then
@@ -22,8 +26,10 @@ function create_database() {
 			rm -rf "$filename"
 			wget -q -c -t 0 -O "$filename" "$url"
 		fi
+		sqlite3 "$database_filename" "DROP TABLE IF EXISTS $table"
 		rows csv2sqlite --schemas=schema/${table}.csv "$filename" "$database_filename"
 	done
+	sqlite3 "$database_filename" "DROP TABLE IF EXISTS epidemiological_week; DROP TABLE IF EXISTS populacao_por_municipio_2020"
 	rows csv2sqlite \
 		--schemas=schema/{populacao-por-municipio,epidemiological-week}.csv \
 		data/{epidemiological-week,populacao-por-municipio-2020}.csv \
@@ -34,18 +40,7 @@ function execute_sql_file_no_output() {
 	database=$1; shift
 	filename=$1
 
-	cat "$filename" | sqlite3 "$database"
-}
-
-function execute_sql_file_with_output() {
-	database=$1; shift
-	sql_filename=$1; shift
-	output_filename=$1
-
-	rows query \
-		"$(cat $sql_filename)" \
-		"$database" \
-		--output="$output_filename"
+	cat "$filename" | sqlite3 -bail "$database"
 }
 
 function setup_database() {
@@ -61,13 +56,8 @@ function execute_sql_files() {
 	database=$1; shift
 	files=$@
 
-	for filename in $files; do
-		if [[ "$(basename $filename)" != *"setup.sql" ]]; then
-			echo "Executing $filename and exporting data"
-			output="data/analysis/$(basename $filename | sed 's/\.sql$/.csv.gz/')"
-			execute_sql_file_with_output "$DATABASE" "$filename" "$output"
-		fi
-	done
+	# Setup files are skipped; queries are executed in parallel
+	python "$SCRIPT_PATH/analysis.py" --output-path="$SCRIPT_PATH/data/analysis" "$database" $files
 }
 
 DATABASE="$SCRIPT_PATH/data/covid19.sqlite"
@@ -0,0 +1,113 @@
+"""Decide if a page text changed, using the cheapest conclusive check
+
+Tiers (the first conclusive one wins):
+1. HTTP 304 (conditional GET with the stored ETag/Last-Modified);
+2. same hash of the normalized text (whitespace collapsed): unchanged;
+3. length difference >= `min_distance`: changed (it is a lower bound of
+   the Levenshtein distance);
+4. Levenshtein distance of the texts (without common prefix/suffix),
+   bounded by `min_distance` so very different texts stop early.
+
+SimHash of word shingles is not conclusive (short texts may have very
+different shingles with a few edits): when it predicts a change, the
+decision is still confirmed by Levenshtein and counted as "simhash".
+"""
+
+import hashlib
+import re
+from collections import Counter
+
+from Levenshtein import distance as levenshtein_distance
+
+SIMHASH_BITS = 64
+SHINGLE_SIZE = 3
+REGEXP_SPACES = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    return REGEXP_SPACES.sub(" ", text or "").strip()
+
+
+def text_hash(text):
+    return hashlib.sha1(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = normalize_text(text).lower().split(" ")
+    if len(words) <= size:
+        return [" ".join(words)]
+    return [" ".join(words[index : index + size]) for index in range(len(words) - size + 1)]
+
+
+def simhash(text):
+    """64-bit SimHash of the text's word shingles
+
+    >>> simhash("the same text") == simhash("The  same\\ntext")
+    True
+    >>> hamming_distance(simhash("a b c d e f"), simhash("x y z w v u")) > 0
+    True
+    """
+    weights = [0] * SIMHASH_BITS
+    for shingle, count in Counter(shingles(text)).items():
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += count if value >> bit & 1 else -count
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def trimmed_levenshtein(a, b, score_cutoff=None):
+    """Levenshtein distance, ignoring the common prefix and suffix (same result)
+
+    If the distance is greater than `score_cutoff`, `score_cutoff + 1` is
+    returned (the computation stops early).
+
+    >>> trimmed_levenshtein("prefix abc suffix", "prefix axc suffix")
+    1
+    >>> trimmed_levenshtein("abcdef", "uvwxyz", score_cutoff=2)
+    3
+    """
+    start, max_start = 0, min(len(a), len(b))
+    while start < max_start and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    return levenshtein_distance(a[start:end_a], b[start:end_b], score_cutoff=score_cutoff)
+
+
+class ChangeDetector:
+    """Detect changes and count which tier decided each one"""
+
+    def __init__(self, simhash_threshold=16):
+        self.simhash_threshold = simhash_threshold
+        self.tiers = Counter()
+
+    def decide(self, tier, changed):
+        self.tiers[tier] += 1
+        return changed
+
+    def not_modified(self):
+        return self.decide("http-304", False)
+
+    def changed(self, old_text, new_text, min_distance, old_hash=None, old_simhash=None, new_simhash=None):
+        """Return True if the Levenshtein distance is at least `min_distance`
+
+        Texts are compared stripped (as the spider stores them).
+        """
+        old_text, new_text = (old_text or "").strip(), (new_text or "").strip()
+        if min_distance <= 0:
+            return self.decide("min-distance", True)
+        if (old_hash or text_hash(old_text)) == text_hash(new_text):  # Only whitespace changed, if any
+            return self.decide("hash", False)
+        if abs(len(old_text) - len(new_text)) >= min_distance:
+            return self.decide("length", True)
+        changed = trimmed_levenshtein(old_text, new_text, score_cutoff=min_distance - 1) >= min_distance
+        if changed and old_simhash is not None and new_simhash is not None:
+            if hamming_distance(old_simhash, new_simhash) > self.simhash_threshold:
+                return self.decide("simhash", True)
+        return self.decide("levenshtein", changed)
@@ -8,9 +8,11 @@ if [ -e "../.env" ]; then
 	source ../.env
 fi
 mkdir -p data
+STATE_FILENAME="${URL_STATE_FILENAME:-data/url-state.sqlite}"
 OUTPUT_FILENAME="data/url-hash.csv"
 rm -rf "$OUTPUT_FILENAME"
-scrapy runspider url_spider.py --loglevel=INFO -a "output_filename=$OUTPUT_FILENAME"
+scrapy runspider url_spider.py --loglevel=INFO -a "state_filename=$STATE_FILENAME"
+python url_store.py export "$STATE_FILENAME" "$OUTPUT_FILENAME"
 s3cmd \
 	--access_key="$S3_ACCESS_KEY" \
 	--secret_key="$S3_SECRET_KEY" \
@@ -1,4 +1,10 @@
 #!/usr/bin/env python
+import datetime
+import queue
+import threading
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
 from urllib.parse import urljoin
 
 import requests
@@ -7,8 +13,10 @@ HTTP_METHODS = "GET HEAD POST PUT DELETE CONNECT OPTIONS TRACE PATCH".lower().sp
 
 
 class RocketChat:
-    def __init__(self, base_url):
+    def __init__(self, base_url, timeout=30):
         self.base_url = base_url
+        self.timeout = timeout
+        self.session = requests.Session()  # Reuse connections
 
     def make_url(self, endpoint):
         return urljoin(self.base_url, f"/api/v1/{endpoint}")
@@ -20,11 +28,14 @@ class RocketChat:
         kwargs["headers"] = kwargs.get("headers", {})
         kwargs["headers"]["X-Auth-Token"] = self.auth_token
         kwargs["headers"]["X-User-Id"] = self.user_id
-        return getattr(requests, method)(*args, **kwargs)
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, *args, **kwargs)
 
     def login(self, username, password):
         self.username = username
-        response = requests.post(self.make_url("login"), data={"user": username, "password": password})
+        response = self.session.post(
+            self.make_url("login"), data={"user": username, "password": password}, timeout=self.timeout,
+        )
         data = response.json()
         assert data["status"] == "success"
         self.user_id = data["data"]["userId"]
@@ -55,6 +66,118 @@ class RocketChat:
         )
 
 
+class NotificationQueue:
+    """Collect notifications and send one message per channel
+
+    Messages added with `add` are only kept in memory (callers never block);
+    `flush` joins each channel's messages (split in parts of at most
+    `max_length` characters, even inside a message) and queues them to a background thread, which
+    sends at most one message per `channel_interval` seconds to a channel
+    and retries when rate limited by the server (HTTP 429).
+    """
+
+    def __init__(self, chat, channel_interval=1.0, max_length=4000, max_retries=3, logger=None):
+        self.chat = chat
+        self.channel_interval = channel_interval
+        self.max_length = max_length
+        self.max_retries = max_retries
+        self.logger = logger
+        self.pending = OrderedDict()
+        self.lock = threading.Lock()
+        self.send_queue = queue.Queue()
+        self.last_sent = {}
+        self.errors = []
+        self.thread = None
+
+    def add(self, channel, message):
+        with self.lock:
+            self.pending.setdefault(channel, []).append(message)
+
+    def split_message(self, messages):
+        parts, current = [], ""
+        for message in messages:
+            if current and len(current) + 2 + len(message) > self.max_length:
+                parts.append(current)
+                current = ""
+            if len(message) > self.max_length:  # Too long even alone
+                for start in range(0, len(message), self.max_length):
+                    parts.append(message[start : start + self.max_length])
+                continue
+            current = f"{current}\n\n{message}" if current else message
+        if current:
+            parts.append(current)
+        return parts
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, OrderedDict()
+        if not pending:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.worker, daemon=True)
+            self.thread.start()
+        for channel, messages in pending.items():
+            for text in self.split_message(messages):
+                self.send_queue.put((channel, text))
+
+    def wait_rate_limit(self, channel):
+        last_sent = self.last_sent.get(channel)
+        if last_sent is not None:
+            wait = self.channel_interval - (time.monotonic() - last_sent)
+            if wait > 0:
+                time.sleep(wait)
+
+    def retry_after(self, response):
+        """Seconds to wait from `Retry-After` (seconds or HTTP date), if valid"""
+        value = response.headers.get("Retry-After")
+        if value:
+            try:
+                return max(float(value), 0)
+            except ValueError:
+                pass
+            try:
+                date = parsedate_to_datetime(value)
+            except (TypeError, ValueError):
+                pass
+            else:
+                if date.tzinfo is None:
+                    date = date.replace(tzinfo=datetime.timezone.utc)
+                return max((date - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
+        return self.channel_interval
+
+    def send(self, channel, text):
+        for _ in range(self.max_retries + 1):
+            self.wait_rate_limit(channel)
+            response = self.chat.send_message(channel, text)
+            self.last_sent[channel] = time.monotonic()
+            if response.status_code != 429:
+                response.raise_for_status()
+                return response
+            time.sleep(self.retry_after(response))
+        response.raise_for_status()
+
+    def worker(self):
+        for channel, text in iter(self.send_queue.get, None):
+            try:
+                self.send(channel, text)
+            except Exception as exception:
+                self.errors.append((channel, exception))
+                if self.logger is not None:
+                    self.logger.error(f"Error sending message to {channel}: {exception}")
+            finally:
+                self.send_queue.task_done()
+        self.send_queue.task_done()
+
+    def close(self):
+        """Send pending messages and wait until everything is sent"""
+        self.flush()
+        if self.thread is not None:
+            self.send_queue.put(None)
+            self.send_queue.join()
+            self.thread.join()
+            self.thread = None
+
+
 if __name__ == "__main__":
     import argparse
     import os
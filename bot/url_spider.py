@@ -6,9 +6,10 @@ import pytz
 import rows
 import scrapy
 from html2text import HTML2Text
-from Levenshtein import distance as levenshtein_distance
 
 import rocketchat
+from change_detector import ChangeDetector, simhash, text_hash
+from url_store import URLStore
 
 URL_LIST_URL = "https://docs.google.com/spreadsheets/d/1S77CvorwQripFZjlWTOZeBhK42rh3u57aRL1XZGhSdI/export?format=csv&id=1S77CvorwQripFZjlWTOZeBhK42rh3u57aRL1XZGhSdI&gid=0"
 HASH_LIST_URL = "https://data.brasil.io/dataset/covid19/url-hash.csv"
@@ -44,6 +45,10 @@ HASH_FIELDS = {
     "last_check_datetime": BrazilianDatetimeField,
     "text": rows.fields.TextField,
     "min_distance": rows.fields.IntegerField,
+    "etag": rows.fields.TextField,
+    "last_modified": rows.fields.TextField,
+    "text_hash": rows.fields.TextField,
+    "simhash": rows.fields.IntegerField,
 }
 
 
@@ -57,34 +62,44 @@ def last_check_str(value):
 
 class URLCheckerSpider(scrapy.Spider):
     name = "url-checker"
-    start_urls = [HASH_LIST_URL]
     custom_settings = {
         "DNS_TIMEOUT": 10,
         "DOWNLOAD_TIMEOUT": 10,
         "USER_AGENT": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.69 Safari/537.36",
     }
 
-    def __init__(self, output_filename, *args, **kwargs):
+    def __init__(self, state_filename=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.output_filename = output_filename
-        self.result = []
+        state_filename = state_filename or os.environ.get("URL_STATE_FILENAME", "data/url-state.sqlite")
+        self.store = URLStore(state_filename)
+        self.checked_urls = None  # Set when the URL list is downloaded
         self.chat = rocketchat.RocketChat(os.environ["ROCKETCHAT_BASE_URL"])
         self.chat.login(os.environ["ROCKETCHAT_USERNAME"], os.environ["ROCKETCHAT_PASSWORD"])
+        # Alerts are sent once per channel, when the spider finishes
+        self.notifications = rocketchat.NotificationQueue(self.chat, logger=self.logger)
+        self.change_detector = ChangeDetector()
+
+    def start_requests(self):
+        if len(self.store) == 0:  # New store: start from the published state
+            yield scrapy.Request(HASH_LIST_URL, callback=self.parse)
+        else:
+            yield scrapy.Request(URL_LIST_URL, callback=self.parse_url_list)
 
     def parse(self, response):
         url_table = rows.import_from_csv(io.BytesIO(response.body), encoding="utf-8", force_types=HASH_FIELDS,)
-        self.URLInfo = url_table.Row
-        self.url_hashes = {row.url: row for row in url_table}
+        self.store.import_rows(row._asdict() for row in url_table)
         yield scrapy.Request(URL_LIST_URL, callback=self.parse_url_list)
 
     def parse_url_list(self, response):
         table = rows.import_from_csv(io.BytesIO(response.body), encoding="utf-8")
+        self.checked_urls = set()
         for row in table:
             url_list = row.boletins_da_secretaria_estadual_de_saude
             if not (url_list or "").strip():
                 continue
             for url in url_list.split(","):
                 url = url.strip()
+                self.checked_urls.add(url)
                 meta = {
                     "state": row.uf,
                     "url": url,
@@ -93,23 +108,38 @@ class URLCheckerSpider(scrapy.Spider):
                     "voluntarios": row.voluntarios,
                 }
                 yield scrapy.Request(
-                    url, callback=self.parse_url, meta={"row": meta}, errback=self.handle_failure, dont_filter=True,
+                    url,
+                    callback=self.parse_url,
+                    headers=self.conditional_headers(self.url_info(url)),
+                    meta={"row": meta, "handle_httpstatus_list": [304]},
+                    errback=self.handle_failure,
+                    dont_filter=True,
                 )
 
+    def conditional_headers(self, url_info):
+        """Headers for a conditional GET (only if the text was stored)"""
+        headers = {}
+        if url_info["text"] and url_info["text"] != "ERROR":
+            if url_info["etag"]:
+                headers["If-None-Match"] = url_info["etag"]
+            if url_info["last_modified"]:
+                headers["If-Modified-Since"] = url_info["last_modified"]
+        return headers
+
     def notify(self, channel, message):
-        self.chat.send_message(channel, message)
+        self.notifications.add(channel, message)
 
     def url_info(self, url):
-        return self.url_hashes.get(url, self.URLInfo(url=url, last_check_datetime=None, text=None, min_distance=None),)
+        return self.store.get(url)
 
     def handle_failure(self, failure):
         meta = failure.request.meta["row"]
         url = meta["url"]
         url_info = self.url_info(url)
-        url_info = url_info._asdict()
         url_info["text"] = "ERROR"
+        url_info["text_hash"] = url_info["simhash"] = url_info["etag"] = url_info["last_modified"] = None
         url_info["last_check_datetime"] = now_in_brazil()
-        self.result.append(url_info)
+        self.store.upsert(url_info)
         if hasattr(failure.value, "response") and hasattr(failure.value.response, "status"):
             failure_str = f"(HTTP {failure.value.response.status}) {failure.value}"
         else:
@@ -127,24 +157,42 @@ class URLCheckerSpider(scrapy.Spider):
     def parse_url(self, response):
         meta = response.meta["row"]
         url = meta["url"]
+        if response.status == 304:  # Not modified since last check, keep the stored text
+            self.change_detector.not_modified()
+            self.store.update_check_datetime(url, now_in_brazil())
+            return
+
         url_info = self.url_info(url)
+        last_check_datetime = url_info["last_check_datetime"]
+        url_info["last_check_datetime"] = now_in_brazil()
+
         html_parser = HTML2Text()
         html_parser.ignore_links = True
         html_parser.ignore_images = True
         text = html_parser.handle(response.body_as_unicode())
         text = (text or "").strip()
-        old_text = (url_info.text or "").strip()
-        if levenshtein_distance(text, old_text) >= meta["min_distance"]:
+        new_simhash = simhash(text)
+        changed = self.change_detector.changed(
+            url_info["text"],
+            text,
+            meta["min_distance"],
+            old_hash=url_info["text_hash"],
+            old_simhash=url_info["simhash"],
+            new_simhash=new_simhash,
+        )
+        if changed:
             volunteer_mentions = self.__to_volunteer_mentions(meta["voluntarios"])
             self.notify(
                 meta["channel"],
                 f"{volunteer_mentions} detectei uma alteração no [site da SES de `{meta['state']}`]({url})."
-                + last_check_str(url_info.last_check_datetime),
+                + last_check_str(last_check_datetime),
             )
-        url_info = url_info._asdict()
-        url_info["last_check_datetime"] = now_in_brazil()
         url_info["text"] = text
-        self.result.append(url_info)
+        url_info["text_hash"] = text_hash(text)
+        url_info["simhash"] = new_simhash
+        url_info["etag"] = response.headers.get("ETag", b"").decode("ascii", errors="ignore") or None
+        url_info["last_modified"] = response.headers.get("Last-Modified", b"").decode("ascii", errors="ignore") or None
+        self.store.upsert(url_info)
 
     def __to_volunteer_mentions(self, name_list):
         return ", ".join(["@{}".format(nome.strip()) for nome in name_list.split(",")])
@@ -155,9 +203,12 @@ class URLCheckerSpider(scrapy.Spider):
         crawler.signals.connect(spider.spider_closed, signal=scrapy.signals.spider_closed)
         return spider
 
-    def spider_closed(self, spider):
-        writer = rows.utils.CsvLazyDictWriter(self.output_filename)
-        result = rows.import_from_dicts(self.result, force_types=HASH_FIELDS)
-        for row in result:
-            row = {key: result.fields[key].serialize(value) for key, value in row._asdict().items()}
-            writer.writerow(row)
+    def spider_closed(self, spider, reason):
+        tiers = ", ".join(f"{tier}: {count}" for tier, count in self.change_detector.tiers.most_common())
+        self.logger.info(f"Change detection tiers used: {tiers or 'none'}")
+        if reason == "finished" and self.checked_urls is not None:
+            # URLs removed from the spreadsheet are not kept (nor exported)
+            removed = self.store.retain(self.checked_urls)
+            self.logger.info(f"Removed {removed} URLs not in the list anymore")
+        self.store.close()  # Each URL was already saved when checked
+        self.notifications.close()
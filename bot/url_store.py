@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""Local state of the URL checker (SQLite), with CSV import/export
+
+Each URL is upserted as soon as it is checked; the text is stored
+compressed. The CSV export (same format as `url-hash.csv`) is only needed
+to publish the state or to bootstrap a new (empty) store.
+"""
+
+import csv
+import datetime
+import sqlite3
+import zlib
+
+FIELD_NAMES = (
+    "url",
+    "last_check_datetime",
+    "text",
+    "min_distance",
+    "etag",
+    "last_modified",
+    "text_hash",
+    "simhash",
+)
+UINT64_SIGN = 1 << 63
+
+
+def to_sqlite_int(value):
+    """SQLite integers are signed, so 64-bit unsigned values are shifted
+
+    >>> from_sqlite_int(to_sqlite_int(2 ** 64 - 1)) == 2 ** 64 - 1
+    True
+    """
+    return None if value is None else value - UINT64_SIGN
+
+
+def from_sqlite_int(value):
+    return None if value is None else value + UINT64_SIGN
+
+
+def compress_text(text):
+    return None if text is None else zlib.compress(text.encode("utf-8"))
+
+
+def decompress_text(data):
+    return None if data is None else zlib.decompress(data).decode("utf-8")
+
+
+def serialize_datetime(value):
+    return None if value is None else value.isoformat()
+
+
+def deserialize_datetime(value):
+    return None if not value else datetime.datetime.fromisoformat(value)
+
+
+class URLStore:
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS url_state (
+                url TEXT PRIMARY KEY,
+                last_check_datetime TEXT,
+                text BLOB,
+                min_distance INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                text_hash TEXT,
+                simhash INTEGER
+            )
+            """
+        )
+        self.connection.commit()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM url_state").fetchone()[0]
+
+    def row_to_dict(self, row):
+        url_info = dict(zip(FIELD_NAMES, row))
+        url_info["last_check_datetime"] = deserialize_datetime(url_info["last_check_datetime"])
+        url_info["text"] = decompress_text(url_info["text"])
+        url_info["simhash"] = from_sqlite_int(url_info["simhash"])
+        return url_info
+
+    def get(self, url):
+        """Return the stored state of `url` (all values `None` if unknown)"""
+        row = self.connection.execute(
+            f"SELECT {', '.join(FIELD_NAMES)} FROM url_state WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None:
+            url_info = dict.fromkeys(FIELD_NAMES)
+            url_info["url"] = url
+            return url_info
+        return self.row_to_dict(row)
+
+    def _upsert(self, url_info):
+        values = {field_name: url_info.get(field_name) for field_name in FIELD_NAMES}
+        values["last_check_datetime"] = serialize_datetime(values["last_check_datetime"])
+        values["text"] = compress_text(values["text"])
+        values["simhash"] = to_sqlite_int(values["simhash"])
+        updates = ", ".join(f"{field_name} = excluded.{field_name}" for field_name in FIELD_NAMES[1:])
+        self.connection.execute(
+            f"""
+            INSERT INTO url_state ({', '.join(FIELD_NAMES)})
+            VALUES ({', '.join(':' + field_name for field_name in FIELD_NAMES)})
+            ON CONFLICT(url) DO UPDATE SET {updates}
+            """,
+            values,
+        )
+
+    def upsert(self, url_info):
+        self._upsert(url_info)
+        self.connection.commit()
+
+    def update_check_datetime(self, url, value):
+        """Save only the check time (the page was not modified)"""
+        self.connection.execute(
+            "UPDATE url_state SET last_check_datetime = ? WHERE url = ?", (serialize_datetime(value), url)
+        )
+        self.connection.commit()
+
+    def retain(self, urls):
+        """Delete all URLs not in `urls` (returns how many were deleted)"""
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS retained_url (url TEXT PRIMARY KEY)")
+            self.connection.execute("DELETE FROM retained_url")
+            self.connection.executemany("INSERT OR IGNORE INTO retained_url VALUES (?)", ((url,) for url in urls))
+            cursor = self.connection.execute("DELETE FROM url_state WHERE url NOT IN (SELECT url FROM retained_url)")
+        return cursor.rowcount
+
+    def __iter__(self):
+        cursor = self.connection.execute(f"SELECT {', '.join(FIELD_NAMES)} FROM url_state ORDER BY url")
+        for row in cursor:
+            yield self.row_to_dict(row)
+
+    def import_rows(self, rows):
+        """Upsert many rows (dicts) in one transaction"""
+        with self.connection:
+            for url_info in rows:
+                self._upsert(url_info)
+
+    def import_csv(self, fobj):
+        """Import an exported CSV (file object opened in text mode)"""
+
+        def deserialize(row):
+            row = {key: value or None for key, value in row.items()}
+            row["last_check_datetime"] = deserialize_datetime(row["last_check_datetime"])
+            for field_name in ("min_distance", "simhash"):
+                if row.get(field_name) is not None:
+                    row[field_name] = int(row[field_name])
+            return row
+
+        self.import_rows(deserialize(row) for row in csv.DictReader(fobj))
+
+    def export_csv(self, fobj):
+        """Export all URLs as CSV (file object opened in text mode)"""
+        writer = csv.DictWriter(fobj, fieldnames=FIELD_NAMES, lineterminator="\n")
+        writer.writeheader()
+        for url_info in self:
+            url_info["last_check_datetime"] = serialize_datetime(url_info["last_check_datetime"])
+            writer.writerow(url_info)
+
+    def close(self):
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ("export", "import"):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("state_filename")
+        subparser.add_argument("csv_filename")
+    args = parser.parse_args()
+
+    store = URLStore(args.state_filename)
+    if args.command == "export":
+        with open(args.csv_filename, mode="w", encoding="utf-8") as fobj:
+            store.export_csv(fobj)
+    elif args.command == "import":
+        with open(args.csv_filename, encoding="utf-8") as fobj:
+            store.import_csv(fobj)
+    store.close()
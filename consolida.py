@@ -1,12 +1,16 @@
-import io
+import asyncio
 import json
 import os
+import shutil
 from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from signal import SIGINT
 
 import rows
 import scrapy
+from rows.utils import open_compressed
 from scrapy.exceptions import CloseSpider
 
 from covid19br import converters, demographics
@@ -15,18 +19,63 @@ DATA_PATH = Path(__file__).absolute().parent / "data"
 ERROR_PATH = DATA_PATH / "error"
 
 
+@lru_cache(maxsize=1)
+def get_executor():
+    return ProcessPoolExecutor()
+
+
+def convert_state_file(state, body, caso_filename):
+    """Decode and convert a state import file (runs in a worker process)
+
+    Cases are streamed to `caso_filename`; the reports (a few rows) and the
+    errors found are returned.
+    """
+    errors, reports = [], []
+    data = json.loads(body)
+    try:
+        reports = list(converters.extract_boletim(state, data["reports"]))
+    except Exception as exp:
+        errors.append(("boletim", state, f"{exp.__class__.__name__}: {exp}"))
+
+    writer = rows.utils.CsvLazyDictWriter(caso_filename)
+    try:
+        for row in converters.extract_caso(state, data.pop("cases")):
+            writer.writerow(row)  # state CSV, used in full.py
+    except Exception as exp:
+        errors.append(("caso", state, f"ERROR PARSING caso for {state}: {exp.args}"))
+    finally:
+        writer.close()
+    return reports, errors
+
+
+def concatenate_csv_files(filenames, output_filename):
+    """Concatenate (possibly compressed) CSV files with the same header"""
+    header_written = False
+    with open_compressed(output_filename, mode="w", encoding="utf-8") as output:
+        for filename in filenames:
+            with open_compressed(filename, encoding="utf-8") as fobj:
+                header = next(fobj, None)
+                if header is None:
+                    continue
+                if not header_written:
+                    output.write(header)
+                    header_written = True
+                shutil.copyfileobj(fobj, output)
+
+
 class ConsolidaSpider(scrapy.Spider):
     name = "consolida"
     base_url = "https://brasil.io/covid19/import-data/{uf}/"
     custom_settings = {
         "CONCURRENT_REQUESTS_PER_DOMAIN": 4,
+        "TWISTED_REACTOR": "twisted.internet.asyncioreactor.AsyncioSelectorReactor",  # Awaits executor futures
     }
 
     def __init__(self, boletim_filename, caso_filename, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.boletim_writer = rows.utils.CsvLazyDictWriter(boletim_filename)
         self.caso_filename = caso_filename
-        self.caso_writer = rows.utils.CsvLazyDictWriter(self.caso_filename)
+        self.state_caso_filenames = {}
         self.errors = defaultdict(list)
 
     def start_requests(self):
@@ -41,53 +90,42 @@ class ConsolidaSpider(scrapy.Spider):
                 callback=self.parse_state_file,
             )
 
-    def parse_boletim(self, state, data):
-        self.logger.info(f"Parsing {state} boletim")
+    async def parse_state_file(self, response):
+        """Convert the state file in a worker process
 
-        try:
-            reports = converters.extract_boletim(state, data)
-        except Exception as exp:
-            self.errors[state].append(("boletim", state, f"{exp.__class__.__name__}: {exp}"))
+        Awaiting the conversion lets the reactor (asyncio) keep downloading
+        other states while this one is converted (Scrapy limits the responses
+        being processed at the same time).
+        """
+        meta = response.meta
+        state = meta["state"]
+        if response.status >= 400:
+            self.errors[state].append(("connection", state, f"HTTP status code: {response.status}"))
+            self.save_state_errors(state)
             return
-        for report in reports:
-            self.logger.debug(report)
-            self.boletim_writer.writerow(report)
 
-    def parse_caso(self, state, filename, data):
-        self.logger.info(f"Parsing {state} caso")
-
-        writer = rows.utils.CsvLazyDictWriter(filename)
+        self.logger.info(f"Parsing {state} boletim and caso")
+        future = get_executor().submit(convert_state_file, state, response.body, meta["caso_filename"])
         try:
-            cases = converters.extract_caso(state, data)
-            for row in cases:
-                self.logger.debug(row)
-                writer.writerow(row)  # state CSV, used in full.py
-                self.caso_writer.writerow(row)  # final CSV, used to import data
+            reports, errors = await asyncio.wrap_future(future)
         except Exception as exp:
-            message = f"ERROR PARSING caso for {state}: {exp.args}"
-            self.errors[state].append(("caso", state, message))
-            self.logger.error(message)
-            writer.close()
+            self.errors[state].append(("caso", state, f"{exp.__class__.__name__}: {exp}"))
+            self.save_state_errors(state)
             return
-        writer.close()
+        self.state_file_converted(state, reports, errors, meta["caso_filename"])
 
-    def parse_state_file(self, response):
-        meta = response.meta
-        state = meta["state"]
-        caso_filename = meta["caso_filename"]
-        if response.status >= 400:
-            self.errors[state].append(("connection", state, f"HTTP status code: {response.status}"))
-        else:
-            response_data = json.load(io.BytesIO(response.body))
-            try:
-                self.parse_boletim(state, response_data["reports"])
-            except Exception as exp:
-                self.errors[state].append(("boletim", state, f"{exp.__class__.__name__}: {exp}"))
-            try:
-                self.parse_caso(state, caso_filename, response_data["cases"])
-            except Exception as exp:
-                self.errors[state].append(("caso", state, f"{exp.__class__.__name__}: {exp}"))
+    def state_file_converted(self, state, reports, errors, caso_filename):
+        for report in reports:
+            self.logger.debug(report)
+            self.boletim_writer.writerow(report)
+        for error in errors:
+            self.logger.error(error[2])
+        self.errors[state].extend(errors)
+        if not any(error[0] == "caso" for error in errors):
+            self.state_caso_filenames[state] = caso_filename
+        self.save_state_errors(state)
 
+    def save_state_errors(self, state):
         if self.errors[state]:
             error_counter = Counter(error[0] for error in self.errors[state])
             error_counter_str = ", ".join(f"{error_type}: {count}" for error_type, count in error_counter.items())
@@ -99,9 +137,17 @@ class ConsolidaSpider(scrapy.Spider):
                 filename.parent.mkdir(parents=True)
             rows.export_to_csv(errors, filename)
 
+    def closed(self, reason):
+        # Final CSV, used to import data (states with errors are left out)
+        filenames = [
+            filename
+            for state, filename in sorted(self.state_caso_filenames.items())
+            if Path(filename).exists()
+        ]
+        concatenate_csv_files(filenames, self.caso_filename)
+
     def __del__(self):
         self.boletim_writer.close()
-        self.caso_writer.close()
 
         state_errors = [errors for errors in self.errors.values() if errors]
         if state_errors:
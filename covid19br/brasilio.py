@@ -0,0 +1,132 @@
+import hashlib
+import json
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlencode
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class BrasilIOError(RuntimeError):
+    pass
+
+
+class ResponseCache:
+    """JSON responses stored on disk, keyed by the full request URL
+
+    Entries older than `ttl` seconds are ignored (and overwritten).
+    """
+
+    def __init__(self, path, ttl=600):
+        self.path = Path(path)
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+        self.ttl = ttl
+
+    def filename(self, url):
+        return self.path / f"{hashlib.sha1(url.encode('utf-8')).hexdigest()}.json"
+
+    def get(self, url):
+        filename = self.filename(url)
+        if not filename.exists() or time.time() - filename.stat().st_mtime > self.ttl:
+            return None
+        with open(filename) as fobj:
+            return json.load(fobj)
+
+    def put(self, url, data):
+        filename = self.filename(url)
+        temp_filename = filename.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_filename, mode="w") as fobj:
+            json.dump(data, fobj)
+        os.replace(temp_filename, filename)
+
+
+class BrasilIO:
+    """Brasil.IO API client
+
+    Connections are reused (and retried with exponential backoff on
+    connection errors, HTTP 429 and 5xx). When the API returns the total
+    count of rows, pages are downloaded concurrently by `max_workers`
+    threads (but yielded in order).
+    """
+
+    base_url = "https://brasil.io/api/"
+
+    def __init__(
+        self,
+        user_agent="brasilio-covid19-scraper",
+        cache_path=None,
+        cache_ttl=600,
+        retries=5,
+        backoff_factor=1,
+        max_workers=4,
+        timeout=60,
+    ):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache = ResponseCache(cache_path, ttl=cache_ttl) if cache_path is not None else None
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_json(self, url, params=None):
+        if params:
+            url += "?" + urlencode(params)
+        if self.cache is not None:
+            data = self.cache.get(url)
+            if data is not None:
+                return data
+
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as exception:
+            raise BrasilIOError(f"Error while downloading {url}: {exception}") from exception
+        if self.cache is not None:
+            self.cache.put(url, data)
+        return data
+
+    def pages(self, dataset, table, page_size=10_000, **filters):
+        """Yield each page (decoded JSON) of a dataset table, in order"""
+        url = f"{self.base_url}dataset/{dataset}/{table}/data/"
+        params = {**filters, "page_size": page_size}
+        first_page = self.get_json(url, params)
+        yield first_page
+        if not first_page.get("next"):
+            return
+
+        count, results = first_page.get("count"), len(first_page["results"])
+        if count is None or not results:  # Cannot know the number of pages, follow the links
+            next_url = first_page["next"]
+            while next_url:
+                page = self.get_json(next_url)
+                yield page
+                next_url = page.get("next")
+            return
+
+        # The API may return less rows than `page_size`, so use the actual size
+        last_page = math.ceil(count / results)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            # Keep a bounded number of pages downloaded ahead of the consumer
+            futures = deque()
+            for page_number in range(2, last_page + 1):
+                futures.append(executor.submit(self.get_json, url, {**params, "page": page_number}))
+                if len(futures) >= 2 * self.max_workers:
+                    yield futures.popleft().result()
+            while futures:
+                yield futures.popleft().result()
+
+    def data(self, dataset, table, page_size=10_000, **filters):
+        """Yield each row (dict) of a dataset table"""
+        for page in self.pages(dataset, table, page_size=page_size, **filters):
+            yield from page["results"]
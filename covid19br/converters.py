@@ -1,5 +1,5 @@
+import datetime
 from collections import defaultdict
-from itertools import groupby
 
 import rows
 
@@ -21,53 +21,112 @@ def extract_boletim(state, data):
         yield row
 
 
-def extract_caso(state, data):
-    cities = defaultdict(dict)
+CASO_NUMBER_TYPES = {"confirmados": "confirmed", "mortes": "deaths"}
+FIRST_CASE_DATE = datetime.date(2020, 2, 25)  # First confirmed case in Brazil
+
+
+def parse_caso_column(key):
+    """Return `(date_str, number_type)` for a `caso` column or `None`
+
+    Columns are named `confirmados_<date>`/`mortes_<date>`, where `<date>` is
+    `YYYY-MM-DD` or `DD_MM` (year is 2020, or 2021 for days before the first
+    case in Brazil).
+
+    >>> parse_caso_column("confirmados_2020-05-01")
+    ('2020-05-01', 'confirmed')
+    >>> parse_caso_column("mortes_31_12")
+    ('2020-12-31', 'deaths')
+    >>> parse_caso_column("mortes_01_01")
+    ('2021-01-01', 'deaths')
+    >>> parse_caso_column("municipio") is None
+    True
+    """
+    prefix, _, date_str = key.partition("_")
+    number_type = CASO_NUMBER_TYPES.get(prefix)
+    if number_type is None or not date_str:
+        return None
+    if "_" in date_str:
+        day, month = date_str.split("_")
+        date = datetime.date(FIRST_CASE_DATE.year, int(month), int(day))
+        if date < FIRST_CASE_DATE:
+            date = date.replace(year=date.year + 1)
+        date_str = date.isoformat()
+    return date_str, number_type
+
+
+def caso_column_plan(data):
+    """Parse each column name of the wide `caso` rows only once
+
+    Return a dict mapping every key to `(date_str, number_type)` (or `None`
+    for non-number columns, like "municipio").
+    """
+    plan = {}
     for caso in data:
-        for key, value in caso.items():
-            if key == "municipio":
-                city_info = demographics.get_city(state, value)
-                if city_info:
-                    caso["municipio"] = city_info.city
+        for key in caso.keys():
+            if key in plan:
                 continue
-            elif key.startswith("confirmados_") or key.startswith("mortes_"):
-                try:
-                    _, date_str = key.split("_")
-                except ValueError:
-                    message = f"ERROR PARSING {repr(key)} - {repr(value)} - {caso}"
-                    raise ValueError(message)
-                if key.startswith("confirmados_"):
-                    number_type = "confirmed"
-                elif key.startswith("mortes_"):
-                    number_type = "deaths"
-            else:
+            try:
+                plan[key] = parse_caso_column(key)
+            except ValueError:
+                message = f"ERROR PARSING {repr(key)} - {repr(caso[key])} - {caso}"
+                raise ValueError(message)
+    return plan
+
+
+def caso_number(value, date_str, number_type, caso):
+    value_type = type(value)
+    if value_type is int:  # Most values (already decoded from JSON)
+        return value
+    elif value is None or value == "":
+        return None
+    elif value_type is float and value.is_integer():
+        return int(value)
+    value = str(value)
+    if value.endswith(".0"):
+        value = value[:-2]
+    if value.startswith("=") and value[1:].isdigit():
+        value = value[1:]
+    try:
+        return int(value)
+    except ValueError:
+        message = f"ERROR converting to int: {date_str} {number_type} {value} {caso}"
+        raise ValueError(message)
+
+
+def group_casos_by_city(state, data):
+    """Group wide `caso` rows by (normalized) city name, in output order"""
+    casos_by_city = defaultdict(list)
+    for caso in data:
+        city_info = demographics.get_city(state, caso["municipio"])
+        if city_info:
+            caso["municipio"] = city_info.city
+        casos_by_city[caso["municipio"]].append(caso)
+    city_key = lambda city: city if city != "TOTAL NO ESTADO" else ""
+    return sorted(casos_by_city.items(), key=lambda item: city_key(item[0]))
+
+
+def extract_city_caso(state, city, casos, plan):
+    """Convert the wide `caso` rows of one city into one row per date"""
+    dates = {}
+    for caso in casos:
+        for key, value in caso.items():
+            column = plan[key]
+            if column is None:
                 continue
-            if date_str not in cities[caso["municipio"]]:
-                cities[caso["municipio"]][date_str] = {}
-            if value in (None, ""):
-                value = None
-            else:
-                value = str(value)
-                if value.endswith(".0"):
-                    value = value[:-2]
-                if value.startswith("=") and value[1:].isdigit():
-                    value = value[1:]
-                try:
-                    value = int(value)
-                except ValueError:
-                    message = f"ERROR converting to int: {date_str} {number_type} {value} {caso}"
-                    raise ValueError(message)
-            cities[caso["municipio"]][date_str][number_type] = value
+            date_str, number_type = column
+            dates.setdefault(date_str, {})[number_type] = caso_number(value, date_str, number_type, caso)
+
     result = []
-    for city, city_data in cities.items():
-        for date_str, date_data in city_data.items():
-            confirmed = date_data["confirmed"]
-            deaths = date_data["deaths"]
-            if confirmed is None and deaths is None:
-                continue
-            confirmed = int(confirmed) if confirmed is not None else None
-            deaths = int(deaths) if deaths is not None else None
-            row = {
+    for date_str, date_data in dates.items():
+        confirmed = date_data["confirmed"]
+        deaths = date_data["deaths"]
+        if confirmed is None and deaths is None:
+            continue
+        if confirmed is None or deaths is None:
+            message = f"ERROR: only one field is filled for {date_str}, {state}, {city}"
+            raise ValueError(message)
+        result.append(
+            {
                 "date": date_str,
                 "state": state,
                 "city": city if city != "TOTAL NO ESTADO" else "",
@@ -75,51 +134,50 @@ def extract_caso(state, data):
                 "confirmed": confirmed,
                 "deaths": deaths,
             }
-            confirmed = row["confirmed"]
-            deaths = row["deaths"]
-            NULL = (None, "")
-            if (confirmed in NULL and deaths not in NULL) or (deaths in NULL and confirmed not in NULL):
-                message = f"ERROR: only one field is filled for {date_str}, {state}, {city}"
-                raise ValueError(message)
-            result.append(row)
-
-    row_key = lambda row: (row["state"], row["city"], row["place_type"])
-    result.sort(key=row_key)
-    groups = groupby(result, key=row_key)
-    for key, row_list_it in groups:
-        row_list = list(row_list_it)
-        row_list.sort(key=lambda row: row["date"])
-        for order_for_place, row in enumerate(row_list, start=1):
-            row["order_for_place"] = order_for_place
-            row["is_last"] = False
-        if row_list:
-            row_list[-1]["is_last"] = True
-
-    for row in result:
-        if row["place_type"] == "city":
-            if row["city"] == "Importados/Indefinidos":
+        )
+    for order_for_place, row in enumerate(sorted(result, key=lambda row: row["date"]), start=1):
+        row["order_for_place"] = order_for_place
+        row["is_last"] = False
+    if result:
+        max(result, key=lambda row: row["date"])["is_last"] = True
+    return result
+
+
+def extract_caso(state, data):
+    """Convert wide `caso` rows (one column per date) into rows per place/date
+
+    Cities are converted (and yielded) one at a time, so only one city's rows
+    are kept in memory besides the input.
+    """
+    plan = caso_column_plan(data)
+    for city, casos in group_casos_by_city(state, data):
+        city_rows = extract_city_caso(state, city, casos, plan)
+        if not city_rows:
+            continue
+        place_type, row_city = city_rows[0]["place_type"], city_rows[0]["city"]
+        if place_type == "city":
+            if row_city == "Importados/Indefinidos":
                 row_population_2020 = row_population_2019 = None
                 row_city_code = None
             else:
-                row_city_code = demographics.city_code(row["state"], row["city"])
-                row_population_2019 = demographics.city_population(row["state"], row["city"], year=2019)
-                row_population_2020 = demographics.city_population(row["state"], row["city"], year=2020)
-        elif row["place_type"] == "state":
-            row_city_code = demographics.state_code(row["state"])
-            row_population_2019 = demographics.state_population(row["state"], year=2019)
-            row_population_2020 = demographics.state_population(row["state"], year=2020)
+                row_city_code = demographics.city_code(state, row_city)
+                row_population_2019 = demographics.city_population(state, row_city, year=2019)
+                row_population_2020 = demographics.city_population(state, row_city, year=2020)
         else:
-            message = f"Invalid row: {row}"
-            raise ValueError(message)
-        row_deaths = row["deaths"]
-        row_confirmed = row["confirmed"]
-        confirmed_per_100k = (
-            100_000 * (row_confirmed / row_population_2020) if row_confirmed and row_population_2020 else None
-        )
-        death_rate = row_deaths / row_confirmed if row_deaths is not None and row_confirmed not in (None, 0) else 0
-        row["estimated_population_2019"] = row_population_2019
-        row["estimated_population"] = row_population_2020
-        row["city_ibge_code"] = row_city_code
-        row["confirmed_per_100k_inhabitants"] = f"{confirmed_per_100k:.5f}" if confirmed_per_100k else None
-        row["death_rate"] = f"{death_rate:.4f}"
-        yield row
+            row_city_code = demographics.state_code(state)
+            row_population_2019 = demographics.state_population(state, year=2019)
+            row_population_2020 = demographics.state_population(state, year=2020)
+
+        for row in city_rows:
+            row_deaths = row["deaths"]
+            row_confirmed = row["confirmed"]
+            confirmed_per_100k = (
+                100_000 * (row_confirmed / row_population_2020) if row_confirmed and row_population_2020 else None
+            )
+            death_rate = row_deaths / row_confirmed if row_confirmed not in (None, 0) else 0
+            row["estimated_population_2019"] = row_population_2019
+            row["estimated_population"] = row_population_2020
+            row["city_ibge_code"] = row_city_code
+            row["confirmed_per_100k_inhabitants"] = f"{confirmed_per_100k:.5f}" if confirmed_per_100k else None
+            row["death_rate"] = f"{death_rate:.4f}"
+            yield row
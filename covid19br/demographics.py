@@ -3,7 +3,8 @@ from functools import lru_cache
 from pathlib import Path
 
 import rows
-from rows.utils import load_schema
+
+from .schemas import Schema
 
 # TODO: use pkg_resources to discover path
 DATA_PATH = Path(__file__).parent / "data"
@@ -17,7 +18,7 @@ POPULATION_SCHEMA_PATH = SCHEMA_PATH / "populacao-por-municipio.csv"
 
 @lru_cache(maxsize=2)
 def cities(year):
-    table = rows.import_from_csv(POPULATION_DATA_PATH[year], force_types=load_schema(str(POPULATION_SCHEMA_PATH)),)
+    table = Schema.from_file(POPULATION_SCHEMA_PATH).read_csv(POPULATION_DATA_PATH[year], row_type=tuple)
     cities = defaultdict(dict)
     for row in table:
         cities[row.state][row.city] = row
@@ -43,12 +44,18 @@ def is_same_city(state, city_a, city_b):
     return normalize_city_name(city_a) == normalize_city_name(city_b)
 
 
+@lru_cache(maxsize=54)
+def city_index(state, year=2020):
+    """Cities of a state keyed by normalized name (built once per process)"""
+    index = {}
+    for city in cities(year)[state].values():
+        index.setdefault(normalize_city_name(city.city), city)
+    return index
+
+
 @lru_cache(maxsize=11140)
 def get_city(state, name, year=2020):
-    state_cities = cities(year)[state].values()
-    for city in state_cities:
-        if is_same_city(state, city.city, name):
-            return city
+    return city_index(state, year).get(normalize_city_name(name))
 
 
 @lru_cache(maxsize=5570)
@@ -5,6 +5,8 @@ from async_process_executor import AsyncProcessExecutor, Task
 from rows.utils import CsvLazyDictWriter
 from tqdm import tqdm
 
+from covid19br.fingerprint import open_fingerprinted
+
 
 class ElasticSearch:
     def __init__(self, base_url, user_agent=None):
@@ -71,7 +73,7 @@ class ElasticSearchConsumer(AsyncProcessExecutor):
 
     async def tasks(self):
         if self.show_progress:
-            self.progress.desc = f"Downloading page 001"
+            self.progress.desc = "Downloading page 001"
             self.progress.refresh()
 
         for page_number, page in enumerate(self.iterator, start=1):
@@ -90,3 +92,40 @@ class ElasticSearchConsumer(AsyncProcessExecutor):
     async def finsihed(self):
         if self.show_progress:
             self.progress.close()
+
+
+def get_data_from_elasticsearch(api_url, index_name, sort_by, username, password, page_size, ttl="10m"):
+    es = ElasticSearch(api_url)
+    iterator = es.paginate(
+        index=index_name, sort_by=sort_by, user=username, password=password, page_size=page_size, ttl=ttl,
+    )
+    progress = tqdm(unit_scale=True)
+    progress.desc = "Downloading page 001"
+    progress.refresh()
+    for page_number, page in enumerate(iterator, start=1):
+        progress.desc = f"Downloaded page {page_number:03d}"
+        progress.refresh()
+        yield page
+    progress.close()
+
+
+def convert_rows(func, iterator):
+    func = func if func is not None else lambda row: row
+    for page in iterator:
+        yield [func(row["_source"]) for row in page["hits"]["hits"]]
+
+
+def write_csv(filename, iterator, write_metadata=False):
+    """Write pages of rows to `filename`
+
+    If `write_metadata` is set, the file fingerprint (see
+    `covid19br.fingerprint`) is saved to a sidecar file while writing.
+    """
+    fobj = open_fingerprinted(filename) if write_metadata else None
+    writer = CsvLazyDictWriter(fobj if fobj is not None else filename)
+    for page in iterator:
+        for row in page:
+            writer.writerow(row)
+    writer.close()
+    if fobj is not None:
+        fobj.close()
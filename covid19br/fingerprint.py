@@ -0,0 +1,210 @@
+"""File fingerprints: SHA1 of the (compressed) file, lines and sizes
+
+Fingerprints can be calculated reading the file once (`file_metadata`) or
+while the file is written (`open_fingerprinted`), and stored in a sidecar
+JSON file (`<filename>.metadata.json`).
+"""
+
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import queue
+import threading
+import zlib
+from pathlib import Path
+
+from tqdm import tqdm
+
+DECOMPRESSORS = {
+    ".bz2": bz2.BZ2Decompressor,
+    ".gz": lambda: zlib.decompressobj(zlib.MAX_WBITS | 16),
+    ".xz": lzma.LZMADecompressor,
+}
+
+
+class LineCounter:
+    """Count lines and bytes of uncompressed data, chunk by chunk"""
+
+    def __init__(self):
+        self.new_lines = 0
+        self.bytes = 0
+        self.last_byte = None
+
+    def update(self, data):
+        if data:
+            self.new_lines += data.count(b"\n")
+            self.bytes += len(data)
+            self.last_byte = data[-1:]
+
+    @property
+    def lines(self):
+        if self.last_byte is not None and self.last_byte != b"\n":
+            return self.new_lines + 1  # Last line has no line break
+        return self.new_lines
+
+
+def decompress_chunks(chunks, new_decompressor):
+    """Decompress a chunk iterator (supports multi-member/stream files)"""
+    decompressor = new_decompressor()
+    for chunk in chunks:
+        while chunk:
+            if decompressor.eof:
+                decompressor = new_decompressor()
+            yield decompressor.decompress(chunk)
+            # Data after the end of a member (skipping null padding)
+            chunk = decompressor.unused_data.lstrip(b"\x00") if decompressor.eof else b""
+
+
+def count_lines_worker(chunk_queue, new_decompressor, counter, errors):
+    chunks = iter(chunk_queue.get, None)
+    try:
+        data_iterator = decompress_chunks(chunks, new_decompressor) if new_decompressor is not None else chunks
+        for data in data_iterator:
+            counter.update(data)
+    except Exception as exception:
+        errors.append(exception)
+        for _ in chunks:  # Keep consuming, so the reader does not block
+            pass
+
+
+def file_metadata(filename, chunk_size=1024 * 1024, progress=True):
+    """Return `(sha1, lines, total_bytes, uncompressed_bytes)` for a file
+
+    The file is read only once: the compressed chunks are hashed here and
+    decompressed/counted by another thread (both `hashlib` and the
+    decompressors release the GIL for big chunks).
+    """
+    new_decompressor = DECOMPRESSORS.get(Path(filename).suffix.lower())
+    hasher, counter, errors = hashlib.sha1(), LineCounter(), []
+    chunk_queue = queue.Queue(maxsize=8)
+    thread = threading.Thread(target=count_lines_worker, args=(chunk_queue, new_decompressor, counter, errors))
+    thread.start()
+    total_bytes = 0
+    try:
+        with open(filename, mode="rb") as fobj, tqdm(unit_scale=True, unit="B", disable=not progress) as bar:
+            for data in iter(lambda: fobj.read(chunk_size), b""):
+                hasher.update(data)
+                chunk_queue.put(data)
+                total_bytes += len(data)
+                bar.update(len(data))
+    finally:
+        chunk_queue.put(None)
+        thread.join()
+    if errors:
+        raise errors[0]
+
+    return hasher.hexdigest(), counter.lines, total_bytes, counter.bytes
+
+
+class HashingWriter(io.RawIOBase):
+    """Binary file wrapper which hashes and counts everything written"""
+
+    def __init__(self, fobj):
+        self.fobj = fobj
+        self.hasher = hashlib.sha1()
+        self.bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.hasher.update(data)
+        self.bytes += len(data)
+        return self.fobj.write(data)
+
+    def flush(self):
+        self.fobj.flush()
+
+    def close(self):
+        if not self.closed:
+            super().close()  # Flushes before closing
+            self.fobj.close()
+
+
+class CountingWriter(io.RawIOBase):
+    """Binary file wrapper which counts lines and bytes of uncompressed data"""
+
+    def __init__(self, fobj, counter):
+        self.fobj = fobj
+        self.counter = counter
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.counter.update(bytes(data))
+        return self.fobj.write(data)
+
+    def flush(self):
+        self.fobj.flush()
+
+    def close(self):
+        if not self.closed:
+            super().close()  # Flushes before closing
+            self.fobj.close()
+
+
+class FingerprintedFile(io.TextIOWrapper):
+    """Text file opened for writing which saves its metadata when closed"""
+
+    def __init__(self, filename, encoding="utf-8", metadata_filename=None):
+        self.filename = Path(filename)
+        self.metadata_filename = metadata_filename or sidecar_filename(filename)
+        self.hashing = HashingWriter(open(filename, mode="wb"))
+        self.counter = LineCounter()
+        compressors = {".bz2": bz2.BZ2File, ".gz": gzip.GzipFile, ".xz": lzma.LZMAFile}
+        compressor = compressors.get(self.filename.suffix.lower())
+        if compressor is gzip.GzipFile:
+            raw = gzip.GzipFile(filename=self.filename.name, fileobj=self.hashing, mode="wb")
+        elif compressor is not None:
+            raw = compressor(self.hashing, mode="wb")
+        else:
+            raw = self.hashing
+        super().__init__(io.BufferedWriter(CountingWriter(raw, self.counter)), encoding=encoding, newline="")
+
+    def close(self):
+        if self.closed:
+            return
+        super().close()
+        self.hashing.close()  # Compressors do not close file objects they did not open
+        self.metadata = save_metadata(
+            self.filename,
+            (self.hashing.hasher.hexdigest(), self.counter.lines, self.hashing.bytes, self.counter.bytes),
+            self.metadata_filename,
+        )
+
+
+def open_fingerprinted(filename, encoding="utf-8"):
+    """Open `filename` for writing (compressed by extension), saving metadata on close"""
+    return FingerprintedFile(filename, encoding=encoding)
+
+
+def sidecar_filename(filename):
+    filename = Path(filename)
+    return filename.parent / f"{filename.name}.metadata.json"
+
+
+def save_metadata(filename, metadata, metadata_filename=None):
+    sha1, lines, total_bytes, uncompressed_bytes = metadata
+    data = {"sha1": sha1, "lines": lines, "bytes": total_bytes, "uncompressed_bytes": uncompressed_bytes}
+    metadata_filename = metadata_filename or sidecar_filename(filename)
+    with open(metadata_filename, mode="w") as fobj:
+        json.dump(data, fobj)
+    return data
+
+
+def load_metadata(filename):
+    """Return metadata from the sidecar file (`None` if missing or outdated)"""
+    metadata_filename = sidecar_filename(filename)
+    if not metadata_filename.exists():
+        return None
+    with open(metadata_filename) as fobj:
+        data = json.load(fobj)
+    stat = os.stat(filename)
+    if data["bytes"] != stat.st_size or metadata_filename.stat().st_mtime < stat.st_mtime:
+        return None
+    return data["sha1"], data["lines"], data["bytes"], data["uncompressed_bytes"]
@@ -0,0 +1,144 @@
+import hashlib
+import io
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+import rows
+from cached_property import cached_property
+from rows.plugins.plugin_pdf import PyMuPDFBackend
+
+
+class PDFDocument:
+    """PDF document loaded once in memory, shared by all its extractions
+
+    Text and objects come from the same backend instance; tables are
+    extracted from the in-memory bytes (no need to write/read files).
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def fobj(self):
+        return io.BytesIO(self.data)
+
+    @cached_property
+    def backend(self):
+        return PyMuPDFBackend(self.fobj())
+
+    @cached_property
+    def text(self):
+        return "".join(item for item in self.backend.extract_text() if item.strip())
+
+    def objects(self, *args, **kwargs):
+        return self.backend.objects(*args, **kwargs)
+
+    def text_objects(self, *args, **kwargs):
+        return self.backend.text_objects(*args, **kwargs)
+
+    def table(self, **kwargs):
+        return rows.import_from_pdf(self.fobj(), **kwargs)
+
+
+def run_extraction(function, data, *args):
+    """Load the PDF and run `function(document, *args)` (inside a worker)
+
+    `function` must be a module-level function and its return value must be
+    picklable (lists/dicts of plain values), since it may run in another
+    process.
+    """
+    return function(PDFDocument(data), *args)
+
+
+class PDFExtractor:
+    """Run PDF extractions in a process pool, returning futures
+
+    Async Scrapy callbacks await the future from `submit` (with
+    `asyncio.wrap_future`, under the asyncio reactor), so the reactor thread
+    keeps downloading while PDFs are parsed concurrently.
+    """
+
+    def __init__(self, max_workers=None):
+        # Daemon processes (like `multiprocessing.Pool` workers) cannot have
+        # children, so fall back to threads there.
+        if multiprocessing.current_process().daemon:
+            self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def submit(self, function, data, *args):
+        return self.executor.submit(run_extraction, function, data, *args)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+@lru_cache(maxsize=1)
+def get_extractor():
+    """Return the process-wide `PDFExtractor`"""
+    return PDFExtractor()
+
+
+class PDFCache:
+    """Data extracted from PDFs, keyed by the SHA1 of the PDF contents
+
+    Each result is stored as a JSON file (dates become ISO strings). The
+    `ETag`/`Last-Modified` headers and the SHA1 last seen for each URL are
+    also kept, so unchanged PDFs can be detected with a `HEAD` request,
+    without downloading them.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+        self.index_filename = self.path / "urls.json"
+        self.urls = {}
+        if self.index_filename.exists():
+            with open(self.index_filename) as fobj:
+                self.urls = json.load(fobj)
+
+    @staticmethod
+    def content_hash(data):
+        return hashlib.sha1(data).hexdigest()
+
+    def filename(self, sha1):
+        return self.path / f"{sha1}.json"
+
+    def __contains__(self, sha1):
+        return self.filename(sha1).exists()
+
+    def get(self, sha1):
+        with open(self.filename(sha1)) as fobj:
+            return json.load(fobj)
+
+    def put(self, sha1, result):
+        with open(self.filename(sha1), mode="w") as fobj:
+            json.dump(result, fobj, default=str)
+
+    @staticmethod
+    def validators(headers):
+        return {
+            key: headers.get(header).decode("ascii") if headers.get(header) else None
+            for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified"))
+        }
+
+    def set_url(self, url, sha1, headers):
+        self.urls[url] = {"sha1": sha1, **self.validators(headers)}
+
+    def cached_sha1(self, url, headers):
+        """Return the SHA1 for `url` if `headers` say it did not change"""
+        stored = self.urls.get(url)
+        if stored is None or stored["sha1"] not in self:
+            return None
+        current = self.validators(headers)
+        for key in ("etag", "last_modified"):
+            if current[key] is not None and current[key] == stored[key]:
+                return stored["sha1"]
+        return None
+
+    def save(self):
+        with open(self.index_filename, mode="w") as fobj:
+            json.dump(self.urls, fobj)
@@ -0,0 +1,130 @@
+import csv
+import datetime
+from collections import namedtuple
+from pathlib import Path
+
+import rows
+from rows.fields import make_header
+from rows.utils import load_schema, open_compressed
+
+SCHEMA_PATH = Path(__file__).parent.parent / "schema"
+BOOL_VALUES = {"True": True, "False": False, "true": True, "false": False}
+
+
+def fast_integer(value):
+    if value.isdigit():
+        return int(value)
+    raise ValueError()
+
+
+def fast_date(value):
+    if len(value) == 10:
+        return datetime.date.fromisoformat(value)
+    raise ValueError()
+
+
+def fast_bool(value):
+    return BOOL_VALUES[value]
+
+
+def fast_text(value):
+    if isinstance(value, str):
+        return value
+    raise ValueError()
+
+
+# Common values (as written by CsvLazyDictWriter) are parsed by these
+# functions; anything else falls back to the field's `deserialize`.
+FAST_DESERIALIZERS = {
+    rows.fields.BoolField: fast_bool,
+    rows.fields.DateField: fast_date,
+    rows.fields.IntegerField: fast_integer,
+    rows.fields.TextField: fast_text,
+}
+_NO_VALUE = object()
+
+
+def make_deserializer(field):
+    """Return a function to deserialize a CSV value as `field` would"""
+    fast = FAST_DESERIALIZERS.get(field)
+    if fast is None:
+        return field.deserialize
+    try:
+        empty = field.deserialize("")  # Computed only once
+    except ValueError:
+        empty = _NO_VALUE
+    slow = field.deserialize
+
+    def deserialize(value):
+        if value == "" and empty is not _NO_VALUE:
+            return empty
+        try:
+            return fast(value)
+        except (ValueError, KeyError, TypeError):
+            return slow(value)
+
+    return deserialize
+
+
+class CompiledSchema:
+    """Deserialize rows of a file with a known header
+
+    The header mapping and the deserializer of each column are built once,
+    then each row is converted with a single pass over its values.
+    """
+
+    def __init__(self, fields, field_names, row_type=dict):
+        self.field_names = tuple(field_names)
+        self.deserializers = tuple(make_deserializer(fields[name]) for name in make_header(self.field_names))
+        self.row_type = row_type
+        if row_type is not dict:
+            self.row_class = namedtuple("Row", make_header(self.field_names))
+
+    def deserialize_values(self, values):
+        result = [deserialize(value) for deserialize, value in zip(self.deserializers, values)]
+        if self.row_type is dict:
+            return dict(zip(self.field_names, result))
+        return self.row_class._make(result)
+
+    def deserialize(self, row):
+        return self.deserialize_values(row.values())
+
+
+class Schema:
+    """Table schema, loaded from a `schema/*.csv` file"""
+
+    @classmethod
+    def from_file(cls, filename):
+        obj = cls()
+        obj.filename = filename
+        obj.fields = load_schema(str(filename))  # TODO: load_schema must support Path objects
+        obj.compiled = {}
+        return obj
+
+    @classmethod
+    def from_table_name(cls, table):
+        return cls.from_file(SCHEMA_PATH / f"{table}.csv")
+
+    def compile(self, field_names, row_type=dict):
+        """Return a `CompiledSchema` for files with this header
+
+        `row_type` may be `dict` or `tuple` (namedtuples, like `rows` ones).
+        """
+        key = (tuple(field_names), row_type)
+        if key not in self.compiled:
+            self.compiled[key] = CompiledSchema(self.fields, field_names, row_type=row_type)
+        return self.compiled[key]
+
+    def deserialize(self, row):
+        return self.compile(row.keys()).deserialize(row)
+
+    def read_csv(self, filename, row_type=dict, encoding="utf-8"):
+        """Yield deserialized rows from a (possibly compressed) CSV file"""
+        with open_compressed(filename, encoding=encoding) as fobj:
+            reader = csv.reader(fobj)
+            header = next(reader, None)
+            if header is None:
+                return
+            deserialize = self.compile(header, row_type=row_type).deserialize_values
+            for values in reader:
+                yield deserialize(values)
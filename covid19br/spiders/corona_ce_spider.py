@@ -1,5 +1,7 @@
+import csv
 import datetime
 import json
+from collections import defaultdict
 from urllib.parse import urlencode, urljoin
 
 import scrapy
@@ -7,9 +9,22 @@ from rows.utils.date import date_range, today
 
 
 class CearaSpider(scrapy.Spider):
+    """Collect confirmed cases and deaths per city from IntegraSUS
+
+    Spider arguments (`-a name=value`):
+    - `mode`: "bulk" (default) makes one request per date, getting confirmed
+      cases and deaths for all cities at once; "per-city" makes one deaths
+      request per city per date (old behavior);
+    - `previous_output`: CSV written by a previous run; only dates missing
+      in it are requested, including gaps left by failed requests (the
+      caller must merge both outputs).
+    """
+
     name = "CE"
     base_url = "https://indicadores.integrasus.saude.ce.gov.br/api/coronavirus/"
     start_date = datetime.date(2020, 3, 2)
+    mode = "bulk"
+    previous_output = None
 
     def make_state_confirmed_request(self, date, callback, meta=None):
         data = {
@@ -20,6 +35,15 @@ class CearaSpider(scrapy.Spider):
         url = urljoin(self.base_url, "qtd-por-municipio") + "?" + urlencode(data)
         return scrapy.Request(url, callback=callback, meta=meta)
 
+    def make_state_bulk_request(self, date, callback, meta=None):
+        data = {
+            "data": date,
+            "idMunicipio": "",
+            "tipo": "Óbito,Confirmado",
+        }
+        url = urljoin(self.base_url, "qtd-por-municipio") + "?" + urlencode(data)
+        return scrapy.Request(url, callback=callback, meta=meta)
+
     def make_city_deaths_request(self, date, city_id, callback, meta=None):
         data = {
             "data": date,
@@ -29,11 +53,52 @@ class CearaSpider(scrapy.Spider):
         url = urljoin(self.base_url, "qtd-obitos") + "?" + urlencode(data)
         return scrapy.Request(url, callback=callback, meta=meta)
 
+    def previous_output_dates(self):
+        if not self.previous_output:
+            return set()
+        with open(self.previous_output) as fobj:
+            return {datetime.date.fromisoformat(row["date"]) for row in csv.DictReader(fobj) if row["date"]}
+
     def start_requests(self):
-        for date in date_range(self.start_date, today()):
-            yield self.make_state_confirmed_request(
-                date, callback=self.parse_state_confirmed, meta={"row": {"date": date}},
-            )
+        done_dates = self.previous_output_dates()
+        dates = [date for date in date_range(self.start_date, today()) if date not in done_dates]
+        if done_dates:
+            self.logger.info(f"{len(done_dates)} dates found in {self.previous_output}, requesting {len(dates)}")
+
+        for date in dates:
+            if self.mode == "bulk":
+                yield self.make_state_bulk_request(date, callback=self.parse_state_bulk, meta={"row": {"date": date}})
+            else:
+                yield self.make_state_confirmed_request(
+                    date, callback=self.parse_state_confirmed, meta={"row": {"date": date}},
+                )
+
+    def city_from_data(self, city_data):
+        city = city_data["municipio"]
+        if city == "Sem informação":
+            return "Importados/Indefinidos", None
+        return city, city_data["idMunicipio"]
+
+    def parse_state_bulk(self, response):
+        date = response.meta["row"]["date"]
+        cases = defaultdict(lambda: {"confirmed": 0, "deaths": 0})
+        for city_data in json.loads(response.body):
+            city, _ = self.city_from_data(city_data)
+            if city_data["tipo"] in ("Positivo", "Confirmado"):
+                cases[city]["confirmed"] = city_data["quantidade"]
+            elif city_data["tipo"] == "Óbito":
+                cases[city]["deaths"] = city_data["quantidade"]
+            else:
+                raise ValueError(f"Unknown case type: {repr(city_data['tipo'])}")
+
+        for city, city_cases in cases.items():
+            yield {
+                "date": date,
+                "city": city,
+                "confirmed": city_cases["confirmed"],
+                "state": self.name,
+                "deaths": city_cases["deaths"],
+            }
 
     def parse_state_confirmed(self, response):
         date = response.meta["row"]["date"]
@@ -41,12 +106,7 @@ class CearaSpider(scrapy.Spider):
 
         for city_data in confirmed_data:
             assert city_data["tipo"] == "Positivo"
-            city = city_data["municipio"]
-            if city == "Sem informação":
-                city = "Importados/Indefinidos"
-                city_id = None
-            else:
-                city_id = city_data["idMunicipio"]
+            city, city_id = self.city_from_data(city_data)
             confirmed = city_data["quantidade"]
             yield self.make_city_deaths_request(
                 date,
@@ -9,6 +9,8 @@ primeiros e dias e outro tipo, mais recentemente:
 Esse script coleta o segundo tipo de boletim.
 """
 
+import asyncio
+import datetime
 import os
 import re
 from pathlib import Path
@@ -18,8 +20,11 @@ import rows
 import scrapy
 from rows.plugins.plugin_pdf import PyMuPDFBackend, same_column
 
+from covid19br.pdf import PDFCache, get_extractor
+
 BASE_PATH = Path(__file__).parent
 DOWNLOAD_PATH = BASE_PATH / "data" / "download"
+CACHE_PATH = DOWNLOAD_PATH / "corona-pr-cache"
 REGEXP_UPDATE = re.compile("Atualização .* ([0-9]{1,2}/[0-9]{1,2}/[0-9]{4}).*")
 
 
@@ -90,34 +95,61 @@ def convert_row(row):
     }
 
 
-def parse_pdf(filename, meta):
+def extract_bulletin(document):
+    """Extract the raw table from a bulletin (runs in the PDF extractor pool)
+
+    Returns `None` for old-style PDFs (image only or patient data), which do
+    not have the data we want. The result depends only on the PDF contents
+    (it is cached by content hash): `{"date": <ISO date or None>, "rows":
+    [...]}`, with values as strings.
+    """
+    if not document.text or "CLASSIFICAÇÃO\nFINAL" in document.text:
+        return None
+
     # Extract update date
-    pdf_doc = PyMuPDFBackend(filename)
     update_date = None
-    for page in pdf_doc.objects():
+    for page in document.objects():
         for obj in page:
             if REGEXP_UPDATE.match(obj.text):
                 update_date = PtBrDateField.deserialize(REGEXP_UPDATE.findall(obj.text)[0])
                 break
-    if update_date is None:  # String not found in PDF
+
+    result = []
+    for row in document.table(backend="min-x0"):
+        if row.municipio == "TOTAL GERAL":
+            continue
+        result.append({key: None if value is None else str(value) for key, value in row._asdict().items()})
+    return {"date": update_date.isoformat() if update_date is not None else None, "rows": result}
+
+
+def bulletin_rows(extraction, meta):
+    """Convert an extracted bulletin, injecting update date and metadata"""
+    if extraction["date"] is not None:
+        update_date = datetime.date.fromisoformat(extraction["date"])
+    else:  # String not found in PDF
         # Parse URL to get date inside PDF's filename
         date = meta["boletim_url"].split("/")[-1].split(".pdf")[0].replace("CORONA_", "").split("_")[0]
         update_date = PtBrDateField2.deserialize(date)
 
-    # Extract rows and inject update date and metadata
-    table = rows.import_from_pdf(filename, backend="min-x0")
-    for row in table:
-        if row.municipio == "TOTAL GERAL":
-            continue
-        row = row._asdict()
-        row["data"] = update_date
-        row.update(meta)
-        yield convert_row(row)
+    result = []
+    for row in extraction["rows"]:
+        row = dict(row, data=update_date, **meta)
+        row = convert_row(row)
+        if row is not None:
+            result.append(row)
+    return result
 
 
 class CoronaPrSpider(scrapy.Spider):
     name = "corona-pr"
     start_urls = ["http://www.saude.pr.gov.br/modules/conteudo/conteudo.php?conteudo=3507"]
+    custom_settings = {
+        "TWISTED_REACTOR": "twisted.internet.asyncioreactor.AsyncioSelectorReactor",  # Awaits extractor futures
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = PDFCache(CACHE_PATH)
 
     def parse(self, response):
         for link in response.xpath("//a[contains(@href, '.pdf')]"):
@@ -129,48 +161,75 @@ class CoronaPrSpider(scrapy.Spider):
                 continue
             data["boletim_data"] = PtBrDateField.deserialize(data["boletim_titulo"].split()[1])
 
-            yield scrapy.Request(
-                url=data["boletim_url"], meta={"row": data}, callback=self.parse_pdf,
-            )
+            if data["boletim_url"] in self.cache.urls:
+                # Already parsed before: check if it changed before downloading
+                yield scrapy.Request(
+                    url=data["boletim_url"], method="HEAD", meta={"row": data}, callback=self.parse_pdf_headers,
+                )
+            else:
+                yield self.make_pdf_request(data)
+
+    def make_pdf_request(self, data):
+        return scrapy.Request(url=data["boletim_url"], meta={"row": data}, callback=self.parse_pdf, dont_filter=True)
+
+    def parse_pdf_headers(self, response):
+        # The cache is keyed by the link's URL (`response.url` may be a redirect)
+        sha1 = self.cache.cached_sha1(response.meta["row"]["boletim_url"], response.headers)
+        if sha1 is None:
+            yield self.make_pdf_request(response.meta["row"])
+        else:
+            self.crawler.stats.inc_value("corona_pr/cached_pdfs")
+            yield from self.parse_bulletin_rows(self.cache.get(sha1), response.meta["row"])
+
+    async def parse_pdf(self, response):
+        sha1 = self.cache.content_hash(response.body)
+        self.cache.set_url(response.meta["row"]["boletim_url"], sha1, response.headers)
+        if sha1 in self.cache:  # Same contents as a PDF already parsed
+            self.crawler.stats.inc_value("corona_pr/cached_pdfs")
+            for row in self.parse_bulletin_rows(self.cache.get(sha1), response.meta["row"]):
+                yield row
+            return
 
-    def parse_pdf(self, response):
         filename = DOWNLOAD_PATH / Path(response.url).name
         with open(filename, mode="wb") as fobj:
             fobj.write(response.body)
 
-        meta = response.meta["row"]
-        pdf_doc = rows.plugins.pdf.PyMuPDFBackend(filename)
-        pdf_text = "".join(item for item in pdf_doc.extract_text() if item.strip())
-
-        if pdf_text and "CLASSIFICAÇÃO\nFINAL" not in pdf_text:
-            # This is a new-style PDF, which has the data we want
-
-            result = []
-            for row in parse_pdf(filename, meta):
-                if row is not None:
-                    result.append(row)
-            result.append(
-                {
-                    "date": result[0]["date"],
-                    "state": "PR",
-                    "city": "",
-                    "place_type": "state",
-                    "notified": sum(row["notified"] for row in result),
-                    "confirmed": sum(row["confirmed"] for row in result),
-                    "discarded": sum(row["discarded"] for row in result),
-                    "suspect": sum(row["suspect"] for row in result),
-                    "deaths": "",  # TODO: fix
-                    "notes": "",
-                    "source_url": result[0]["source_url"],
-                }
-            )
-            result.sort(key=lambda row: row["city"])
-            for row in result:
-                yield row
+        # The PDF is parsed in the extractor's process pool, without
+        # blocking the reactor while waiting for it.
+        extraction = await asyncio.wrap_future(get_extractor().submit(extract_bulletin, response.body))
+        self.cache.put(sha1, extraction)
+        for row in self.parse_bulletin_rows(extraction, response.meta["row"], filename):
+            yield row
 
-        else:
+    def parse_bulletin_rows(self, extraction, meta, filename=None):
+        """Convert an extraction using the current link's `meta` (it may be cached from another URL)"""
+        if extraction is None:
             # Old style PDFs are not parsed and should be removed from disk
             # Old styles are PDFs which:
             # - Have an image, no text
             # - Patient data (not number of cases per city)
-            os.unlink(filename)
+            if filename is not None:
+                os.unlink(filename)
+            return []
+
+        result = bulletin_rows(extraction, meta)
+        result.append(
+            {
+                "date": result[0]["date"],
+                "state": "PR",
+                "city": "",
+                "place_type": "state",
+                "notified": sum(row["notified"] for row in result),
+                "confirmed": sum(row["confirmed"] for row in result),
+                "discarded": sum(row["discarded"] for row in result),
+                "suspect": sum(row["suspect"] for row in result),
+                "deaths": "",  # TODO: fix
+                "notes": "",
+                "source_url": result[0]["source_url"],
+            }
+        )
+        result.sort(key=lambda row: row["city"])
+        return result
+
+    def closed(self, reason):
+        self.cache.save()
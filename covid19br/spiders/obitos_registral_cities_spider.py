@@ -1,17 +1,41 @@
+import datetime
 import json
+from collections import Counter, defaultdict
 from urllib.parse import urlencode, urljoin
 
-import scrapy
 from epiweeks import Week
-from rows.date.utils import today
+from rows.utils.date import today
+
+from ..utils import brazilian_epidemiological_week
+from .obitos_spider import CHART_TYPE_CHOICES, PLACE_CHOICES, BaseRegistroCivilSpider
 
 # TODO: epiweeks is not needed anymore
 
 
-class DeathsSpider(scrapy.Spider):
+def daily_causes_by_week(data):
+    """Sum a daily chart (`{"YYYY-MM-DD": {cause: [{"total": ...}]}}`) by epidemiological week
+
+    Raises `ValueError` if the chart does not have this format.
+    """
+    chart_data = data["chart"] or {}
+    if not isinstance(chart_data, dict):
+        raise ValueError(f"Unexpected chart type: {type(chart_data).__name__}")
+    causes_by_week = defaultdict(Counter)
+    for key, causes in chart_data.items():
+        week_causes = causes_by_week[brazilian_epidemiological_week(datetime.date.fromisoformat(key))]
+        for cause, cause_data in causes.items():
+            week_causes[cause] += int(cause_data[0]["total"])
+    return causes_by_week
+
+
+class DeathsSpider(BaseRegistroCivilSpider):
     name = "obitos_registral_cities"
     cities_url = "https://transparencia.registrocivil.org.br/api/covid-cities"
     registral_url = "https://transparencia.registrocivil.org.br/api/covid-covid-registral"
+    # "range" makes one request per city per year, asking for the daily chart
+    # and grouping it into epidemiological weeks locally; "weekly" makes one
+    # request per city per week. Use `-a request_mode=weekly` to change it.
+    request_mode = "range"
 
     causes_map = {
         "sars": "SRAG",
@@ -27,7 +51,7 @@ class DeathsSpider(scrapy.Spider):
             "total": total,  # Seems not to be working, it's always 100
             "type": "registral-covid",
         }
-        return scrapy.Request(
+        return self.make_request(
             url=urljoin(self.cities_url, "?" + urlencode(data)),
             callback=callback,
             meta={"row": data, "dont_cache": dont_cache},
@@ -44,13 +68,38 @@ class DeathsSpider(scrapy.Spider):
             "start_date": str(ep_week.startdate()),
             "end_date": str(ep_week.enddate()),
         }
-        return scrapy.Request(
+        return self.make_request(
             url=urljoin(self.registral_url, "?" + urlencode(data)),
             callback=callback,
             meta={"row": data, "city_name": city["nome"], "ep_week": ep_week, "dont_cache": dont_cache,},
         )
 
-    def start_requests(self):
+    def make_registral_range_request(self, city, ep_weeks, callback):
+        """Request the daily chart for all `ep_weeks` of a city at once"""
+        data = [
+            ("start_date", str(ep_weeks[0].startdate())),
+            ("end_date", str(ep_weeks[-1].enddate())),
+            ("city_id", city["city_id"]),
+            ("state", city["uf"]),
+            ("diffCity", "false"),
+            ("cor_pele", "I"),
+        ]
+        for place in PLACE_CHOICES:
+            data.append(("places[]", place))
+        data.append(("chart", CHART_TYPE_CHOICES["respiratory"]["name"]))
+        return self.make_request(
+            url=urljoin(self.registral_url, "?" + urlencode(data)),
+            callback=callback,
+            meta={"city": city, "ep_weeks": ep_weeks},
+        )
+
+    def make_weekly_requests(self, city, ep_weeks):
+        for ep_week in ep_weeks:
+            yield self.make_registral_request(
+                city=city, ep_week=ep_week, callback=self.parse_registral_request,
+            )
+
+    def start_requests_after_login(self):
         yield self.make_cities_request(total=100, callback=self.parse_cities_request, dont_cache=False)
 
     def parse_cities_request(self, response):
@@ -66,40 +115,55 @@ class DeathsSpider(scrapy.Spider):
 
         for city in cities:
             for year in [2020, 2019]:
-                for weeknum in range(1, current_week.week):
-                    ep_week = Week(year, weeknum)  # TODO: change to (year, week)
-
-                    # Cache more than 4 weeks ago
-                    should_cache = (current_week.week - weeknum) > 4
-                    yield self.make_registral_request(
-                        city=city, ep_week=ep_week, callback=self.parse_registral_request, dont_cache=not should_cache,
+                # TODO: change to (year, week)
+                ep_weeks = [Week(year, weeknum) for weeknum in range(1, current_week.week)]
+                if not ep_weeks:
+                    continue
+                # Caching is decided by `make_request`, based on the period's end date
+                if self.request_mode == "range":
+                    yield self.make_registral_range_request(
+                        city=city, ep_weeks=ep_weeks, callback=self.parse_registral_range_request,
                     )
+                else:
+                    yield from self.make_weekly_requests(city, ep_weeks)
 
-    def add_causes(self, row, data):
+    def make_row(self, city, ep_week, causes):
+        row = {
+            "city_id": city["city_id"],
+            "state": city["uf"],
+            "start_date": str(ep_week.startdate()),
+            "end_date": str(ep_week.enddate()),
+            "city_name": city["nome"],
+            "epidemiological_year": ep_week.year,
+            "epidemiological_week": ep_week.week,
+        }
         for cause, portuguese_name in self.causes_map.items():
-            row[cause] = data[portuguese_name]
+            row[cause] = causes.get(portuguese_name, 0)
+        row["covid"] = causes.get("COVID", 0)
+        return row
 
     def parse_registral_request(self, response):
-        ep_week = response.meta["ep_week"]
-
-        row = response.meta["row"].copy()
-        row["city_name"] = response.meta["city_name"]
-        row["epidemiological_year"], row["epidemiological_week"] = ep_week
-
+        meta = response.meta
+        city = {"city_id": meta["row"]["city_id"], "uf": meta["row"]["state"], "nome": meta["city_name"]}
         data = json.loads(response.body)
 
-        if "dont_cache" in row:
-            del row["dont_cache"]
-
-        for cause in self.causes_map:
-            row[cause] = 0
-
-        row["covid"] = 0
-
         chart_data = data["chart"]
-        if chart_data:
-            if "2020" in chart_data:
-                self.add_causes(row, chart_data["2020"])
-                row["covid"] = chart_data["2020"]["COVID"]
-
-        yield row
+        causes = chart_data.get("2020", {}) if chart_data else {}
+        yield self.make_row(city, meta["ep_week"], causes)
+
+    def parse_registral_range_request(self, response):
+        city, ep_weeks = response.meta["city"], response.meta["ep_weeks"]
+        try:
+            causes_by_week = daily_causes_by_week(json.loads(response.body))
+        except (ValueError, TypeError, KeyError, AttributeError, IndexError) as exception:
+            # No daily breakdown (or unexpected data) for this period, so fall
+            # back to one request per epidemiological week.
+            self.logger.warning(
+                f"No daily chart for {city['nome']}/{city['uf']} from {ep_weeks[0].startdate()} to "
+                f"{ep_weeks[-1].enddate()} ({exception.__class__.__name__}: {exception}), requesting weekly data"
+            )
+            yield from self.make_weekly_requests(city, ep_weeks)
+            return
+
+        for ep_week in ep_weeks:
+            yield self.make_row(city, ep_week, causes_by_week[(ep_week.year, ep_week.week)])
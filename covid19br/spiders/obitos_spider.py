@@ -1,8 +1,12 @@
 import datetime
 import json
-from urllib.parse import urlencode, urljoin
+import math
+import sqlite3
+import zlib
+from urllib.parse import parse_qsl, urlencode, urljoin, urlparse
 
 import scrapy
+from scrapy.http import TextResponse
 from scrapy.http.cookies import CookieJar
 
 STATES = "AC AL AM AP BA CE DF ES GO MA MG MS MT PA PB PE PI PR RJ RN RO RR RS SC SE SP TO".split()
@@ -33,38 +37,314 @@ def qs_to_dict(data):
     return {key: value if len(value) > 1 else value[0] for key, value in new.items()}
 
 
+def percentile(values, p):
+    """Nearest-rank percentile of an already sorted sequence
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    >>> percentile([], 50) is None
+    True
+    """
+    if not values:
+        return None
+    index = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[index]
+
+
+class RegistroCivilCache:
+    """Cache for parsed API responses, keyed by (endpoint, state, city, period)
+
+    Responses are stored as compact, zlib-compressed JSON in a SQLite file.
+    A period is "frozen" when it ended more than `horizon` days ago: frozen
+    periods are served from the cache and never requested again, while the
+    recent ones are always requested (and the cache updated).
+    """
+
+    period_fields = ("start_date", "end_date")
+
+    def __init__(self, filename, horizon=30, commit_every=100):
+        self.filename = str(filename)
+        self.horizon = datetime.timedelta(days=horizon)
+        self.commit_every = commit_every
+        self.hits = self.misses = self._pending = 0
+        self.connection = sqlite3.connect(self.filename)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS response (
+                endpoint TEXT NOT NULL,
+                state TEXT NOT NULL,
+                city TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                frozen INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (endpoint, state, city, start_date, end_date)
+            )
+            """
+        )
+
+    @classmethod
+    def key_from_url(cls, url):
+        """Return the cache key for `url` or `None` if it's not a period request
+
+        >>> RegistroCivilCache.key_from_url(
+        ...     "https://example.com/api/a?start_date=2020-01-01&end_date=2020-01-31&state=SP&chart=x"
+        ... )
+        ('/api/a?chart=x', 'SP', '', '2020-01-01', '2020-01-31')
+        >>> RegistroCivilCache.key_from_url("https://example.com/api/a?state=SP") is None
+        True
+
+        Repeated and blank parameters are part of the key:
+
+        >>> url = "https://example.com/api/a?start_date=2020-01-01&end_date=2020-01-31&places[]=HOSPITAL&city_id="
+        >>> RegistroCivilCache.key_from_url(url)[0]
+        '/api/a?places%5B%5D=HOSPITAL'
+        >>> RegistroCivilCache.key_from_url(url + "&places[]=DOMICILIO")[0]
+        '/api/a?places%5B%5D=DOMICILIO&places%5B%5D=HOSPITAL'
+        """
+        parsed = urlparse(url)
+        key_fields = ("start_date", "end_date", "state", "city_id")
+        params, fields = [], {}
+        for key, value in parse_qsl(parsed.query, keep_blank_values=True):
+            if key in key_fields:
+                fields[key] = value
+            else:
+                params.append((key, value))
+        if not all(field in fields for field in cls.period_fields):
+            return None
+        city = fields.get("city_id", "")
+        if city == "all":
+            city = ""
+        endpoint = parsed.path + "?" + urlencode(sorted(params))
+        return (endpoint, fields.get("state", ""), city, fields["start_date"], fields["end_date"])
+
+    def is_frozen(self, end_date, today=None):
+        if isinstance(end_date, str):
+            end_date = datetime.date.fromisoformat(end_date)
+        return (today or datetime.date.today()) - end_date > self.horizon
+
+    def get(self, key):
+        """Return the cached JSON for `key` if its period is frozen"""
+        row = self.connection.execute(
+            """
+            SELECT data FROM response
+            WHERE endpoint = ? AND state = ? AND city = ? AND start_date = ? AND end_date = ? AND frozen = 1
+            """,
+            key,
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key, data):
+        value = zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO response VALUES (?, ?, ?, ?, ?, ?, ?)",
+            key + (int(self.is_frozen(key[-1])), value),
+        )
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.connection.commit()
+            self._pending = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class XSRFTokenMiddleware:
+    """Set the spider's current XSRF token when a request is downloaded
+
+    Requests may wait in the scheduler while the token is refreshed, so the
+    header is not set when they are created.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_request(self, request, spider=None):
+        spider = spider or self.crawler.spider
+        if "registro_civil_callback" in request.meta:
+            request.headers["X-XSRF-TOKEN"] = spider.xsrf_token
+            request.meta["xsrf_token"] = spider.xsrf_token
+
+
 class BaseRegistroCivilSpider(scrapy.Spider):
+    """Base spider with a shared request scheduler for Registro Civil's API
+
+    - Requests are prioritized: non-cached (recent) periods first, then the
+      most recent periods;
+    - Concurrency is limited per host (`REGISTRO_CIVIL_CONCURRENCY` setting);
+    - The XSRF token is set when each request is downloaded
+      (`XSRFTokenMiddleware`) and refreshed on HTTP 401/419: the failed
+      requests are re-scheduled, without restarting the crawl (requests
+      sent with an already replaced token are just re-scheduled);
+    - Requests for periods already frozen in `RegistroCivilCache`
+      (`REGISTRO_CIVIL_CACHE` setting) are answered from the cache;
+    - Request latency percentiles are logged when the spider closes.
+    """
+
     cookie_jar = CookieJar()
     login_url = "https://transparencia.registrocivil.org.br/especial-covid"
     start_urls = []
     xsrf_token = ""
+    token_error_codes = (401, 419)
+    max_token_refreshes = 3
+    non_cached_priority = 1000
     custom_settings = {
         "USER_AGENT": "User-Agent: Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.44 Safari/537.36",
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 8,
+        "DOWNLOADER_MIDDLEWARES": {XSRFTokenMiddleware: 950},
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        self.refreshing_token = False
+        self.waiting_token = []
+        self.cache = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        cache_filename = crawler.settings.get("REGISTRO_CIVIL_CACHE")
+        if cache_filename:
+            horizon = crawler.settings.getint("REGISTRO_CIVIL_CACHE_HORIZON", 30)
+            spider.cache = RegistroCivilCache(cache_filename, horizon=horizon)
+        return spider
+
+    @classmethod
+    def update_settings(cls, settings):
+        super().update_settings(settings)
+        concurrency = settings.getint("REGISTRO_CIVIL_CONCURRENCY", 0)
+        if concurrency > 0:
+            settings.set("CONCURRENT_REQUESTS_PER_DOMAIN", concurrency, priority="cmdline")
+
     def start_requests(self):
         yield self.make_login_request()
 
-    def make_login_request(self):
-        return scrapy.Request(url=self.login_url, callback=self.parse_login_response, meta={"dont_cache": True},)
+    def make_login_request(self, callback=None):
+        return scrapy.Request(
+            url=self.login_url,
+            callback=callback or self.parse_login_response,
+            meta={"dont_cache": True},
+            priority=self.non_cached_priority * 10,
+            dont_filter=True,
+        )
+
+    def request_priority(self, period_end=None, dont_cache=False):
+        """Non-cached periods first, then from the most recent to the oldest"""
+        priority = self.non_cached_priority if dont_cache else 0
+        if period_end is not None:
+            priority -= min((datetime.date.today() - period_end).days // 30, self.non_cached_priority - 1)
+        return priority
 
-    def make_request(self, *args, **kwargs):
-        kwargs["headers"] = kwargs.get("headers", {})
-        kwargs["headers"]["X-XSRF-TOKEN"] = self.xsrf_token
-        return scrapy.Request(*args, **kwargs)
+    def make_request(self, url, **kwargs):
+        """Create a request to the API, passing through the scheduler
+
+        The real callback is saved (by name) in `meta` so responses with
+        expired tokens can be intercepted and re-scheduled. For period
+        requests, `dont_cache` is decided by the period's age (frozen periods
+        are cached).
+        """
+        meta = kwargs["meta"] = kwargs.get("meta", {})
+        callback = kwargs.pop("callback", None) or self.parse
+        meta["registro_civil_callback"] = callback.__name__
+        meta["handle_httpstatus_list"] = list(self.token_error_codes)
+        cache_key = RegistroCivilCache.key_from_url(url)
+        period_end = None
+        if cache_key is not None:
+            period_end = datetime.date.fromisoformat(cache_key[-1])
+            meta["cache_key"] = cache_key
+            if self.cache is not None:
+                meta["dont_cache"] = not self.cache.is_frozen(period_end)
+        kwargs.setdefault("priority", self.request_priority(period_end, meta.get("dont_cache", False)))
+        return scrapy.Request(url, callback=self.parse_api_response, **kwargs)
+
+    def resolve_cached(self, results):
+        """Answer requests for frozen periods from the cache, without network"""
+        for result in results:
+            cache_key = result.meta.get("cache_key") if isinstance(result, scrapy.Request) else None
+            data = self.cache.get(cache_key) if cache_key is not None and self.cache is not None else None
+            if data is None:
+                yield result
+                continue
+            body = json.dumps(data).encode("utf-8")
+            response = TextResponse(url=result.url, body=body, encoding="utf-8", request=result, flags=["cached"])
+            yield from self.resolve_cached(getattr(self, result.meta["registro_civil_callback"])(response) or [])
 
     def start_requests_after_login(self):
         for url in self.start_urls:
             yield self.make_request(url, callback=self.parse)
 
-    def parse_login_response(self, response):
+    def update_token(self, response):
         self.cookie_jar.extract_cookies(response, response.request)
         self.xsrf_token = next(c for c in self.cookie_jar if c.name == "XSRF-TOKEN").value
 
-        for request in self.start_requests_after_login():
-            yield request
+    def parse_login_response(self, response):
+        self.update_token(response)
+
+        yield from self.resolve_cached(self.start_requests_after_login())
+
+    def parse_token_refresh(self, response):
+        self.update_token(response)
+        self.refreshing_token = False
+        self.logger.info(f"XSRF token refreshed, re-scheduling {len(self.waiting_token)} requests")
+        waiting, self.waiting_token = self.waiting_token, []
+        for request in waiting:
+            yield request.replace(dont_filter=True)
+
+    def parse_api_response(self, response):
+        latency = response.meta.get("download_latency")
+        if latency is not None:
+            self.latencies.append(latency)
+
+        if response.status in self.token_error_codes:
+            request = response.request
+            refreshes = request.meta.get("token_refreshes", 0) + 1
+            if refreshes > self.max_token_refreshes:
+                self.logger.error(f"Giving up {request.url} after {refreshes - 1} token refreshes")
+                return
+            request.meta["token_refreshes"] = refreshes
+            if request.meta.get("xsrf_token") != self.xsrf_token and not self.refreshing_token:
+                # Sent before the last refresh: the current token may work
+                yield request.replace(dont_filter=True)
+                return
+            self.waiting_token.append(request)
+            if not self.refreshing_token:
+                self.refreshing_token = True
+                yield self.make_login_request(callback=self.parse_token_refresh)
+            return
+
+        cache_key = response.meta.get("cache_key")
+        if self.cache is not None and cache_key is not None and response.status == 200:
+            self.cache.put(cache_key, json.loads(response.body))
+
+        callback = getattr(self, response.meta["registro_civil_callback"])
+        yield from self.resolve_cached(callback(response) or [])
+
+    def closed(self, reason):
+        if self.cache is not None:
+            self.logger.info(f"Registro Civil cache: {self.cache.hits} hits, {self.cache.misses} misses")
+            self.crawler.stats.set_value("registro_civil_cache/hits", self.cache.hits)
+            self.crawler.stats.set_value("registro_civil_cache/misses", self.cache.misses)
+            self.cache.close()
+
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return
+        summary = ", ".join(f"p{p}={percentile(latencies, p):.3f}s" for p in (50, 90, 99))
+        self.logger.info(f"Request latency for {len(latencies)} requests: {summary}, max={latencies[-1]:.3f}s")
 
-    def parse(self):
+    def parse(self, response):
         raise NotImplementedError()
 
 
@@ -99,7 +379,6 @@ class DeathsSpider(BaseRegistroCivilSpider):
                     start_date=datetime.date(year, 1, 1),
                     end_date=datetime.date(year, 12, 31),
                     state=state,
-                    dont_cache=True,
                 )
 
     def make_chart_request(
@@ -135,7 +414,6 @@ class DeathsSpider(BaseRegistroCivilSpider):
 
         return self.make_request(
             url=urljoin(base_url, "?" + urlencode(data)),
-            headers={"X-XSRF-TOKEN": self.xsrf_token},
             callback=self.parse_chart_response,
             meta={"row": qs_to_dict(data), "dont_cache": dont_cache, "chart_type": chart_type},
         )
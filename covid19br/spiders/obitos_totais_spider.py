@@ -29,20 +29,13 @@ class TotalDeathsSpider(BaseRegistroCivilSpider):
 
     def start_requests_after_login(self):
         one_day = datetime.timedelta(days=1)
-        non_cache_period = datetime.timedelta(days=30)
         # `date_range` excludes the last, so we need to add one day to
-        # `end_date`.
+        # `end_date`. Caching is decided by `make_request` (only periods older
+        # than the cache horizon, which are unlikely to change, are cached).
         for date in date_range(self.start_date, self.end_date + one_day, interval="monthly"):
-            # Won't cache dates from 30 days ago until today (only historical
-            # ones which are unlikely to change).
-            should_cache = today() - date > non_cache_period
             for state in STATES:
                 yield self.make_state_request(
-                    start_date=date,
-                    end_date=next_month(date) - one_day,
-                    state=state,
-                    callback=self.parse,
-                    dont_cache=not should_cache,
+                    start_date=date, end_date=next_month(date) - one_day, state=state, callback=self.parse,
                 )
 
     def parse(self, response):
@@ -0,0 +1,141 @@
+"""Run state spiders concurrently in the same process/reactor
+
+Usage: python -m covid19br.spiders.run_states [--output-path ...] ce pr sp
+"""
+
+import argparse
+import logging
+import shutil
+import time
+from pathlib import Path
+
+from scrapy import signals
+from scrapy.crawler import Crawler, CrawlerProcess
+
+from covid19br.spiders.corona_ce_spider import CearaSpider
+from covid19br.spiders.corona_pr_spider import CoronaPrSpider
+from covid19br.spiders.corona_sp_spider import SPSpider
+
+STATE_SPIDERS = {
+    "ce": CearaSpider,
+    "pr": CoronaPrSpider,
+    "sp": SPSpider,
+}
+
+
+class SpiderLogFilter(logging.Filter):
+    """Accept only log records from a specific spider"""
+
+    def __init__(self, spider_name):
+        super().__init__()
+        self.spider_name = spider_name
+
+    def filter(self, record):
+        spider = getattr(record, "spider", None)
+        if spider is not None:
+            return spider.name == self.spider_name
+        return record.name == self.spider_name
+
+
+class SpiderTimer:
+    def __init__(self):
+        self.started, self.finished, self.reasons = {}, {}, {}
+
+    def spider_opened(self, spider):
+        self.started[spider.name] = time.time()
+
+    def spider_closed(self, spider, reason):
+        self.finished[spider.name] = time.time()
+        self.reasons[spider.name] = reason
+
+    def elapsed(self, spider_name):
+        if spider_name not in self.finished:
+            return None
+        return self.finished[spider_name] - self.started[spider_name]
+
+
+def add_spider_log_handler(spider_name, filename, level):
+    handler = logging.FileHandler(filename, mode="w")
+    handler.setLevel(level)
+    handler.setFormatter(logging.Formatter("%(asctime)s [%(name)s] %(levelname)s: %(message)s"))
+    handler.addFilter(SpiderLogFilter(spider_name))
+    logging.getLogger().addHandler(handler)
+    return handler
+
+
+def merge_previous_output(previous_filename, output_filename):
+    """Append new rows (without header) to the previous output and replace it"""
+    if output_filename.exists() and output_filename.stat().st_size > 0:
+        with open(output_filename) as new, open(previous_filename, mode="a") as previous:
+            next(new, None)  # Skip header
+            shutil.copyfileobj(new, previous)
+    shutil.move(previous_filename, output_filename)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output-path", default="data/output")
+    parser.add_argument("--download-path", default="data/download")
+    parser.add_argument("--log-path", default="data/log")
+    parser.add_argument("--log-level", default="INFO")
+    parser.add_argument("states", nargs="*", default=list(STATE_SPIDERS.keys()))
+    args = parser.parse_args()
+
+    output_path, download_path, log_path = Path(args.output_path), Path(args.download_path), Path(args.log_path)
+    for path in (output_path, download_path, log_path):
+        path.mkdir(parents=True, exist_ok=True)
+    for state in args.states:
+        if state not in STATE_SPIDERS:
+            parser.error(f"Unknown state spider: {repr(state)}")
+
+    process = CrawlerProcess(
+        settings={"LOG_LEVEL": args.log_level, "LOG_FILE": str(log_path / "caso-spiders.log")}
+    )
+    timer = SpiderTimer()
+    crawlers, previous_outputs = {}, {}
+    for state in args.states:
+        SpiderClass = STATE_SPIDERS[state]
+        output_filename = output_path / f"caso-{state}.csv"
+        spider_kwargs = {}
+        if hasattr(SpiderClass, "previous_output") and output_filename.exists() and output_filename.stat().st_size:
+            # Incremental spider: only collect data after the last output
+            previous_filename = download_path / f"caso-{state}-previous.csv"
+            shutil.move(output_filename, previous_filename)
+            previous_outputs[state] = previous_filename
+            spider_kwargs["previous_output"] = str(previous_filename)
+        elif output_filename.exists():
+            output_filename.unlink()
+
+        settings = process.settings.copy()
+        settings.set("FEEDS", {str(output_filename): {"format": "csv"}})
+        crawler = Crawler(SpiderClass, settings)
+        crawler.signals.connect(timer.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(timer.spider_closed, signal=signals.spider_closed)
+        add_spider_log_handler(SpiderClass.name, log_path / f"caso-{state}.log", args.log_level)
+        process.crawl(crawler, **spider_kwargs)
+        crawlers[state] = crawler
+
+    start = time.time()
+    process.start()
+    total_elapsed = time.time() - start
+
+    for state, previous_filename in previous_outputs.items():
+        merge_previous_output(previous_filename, output_path / f"caso-{state}.csv")
+
+    print(f"{'state':<6} {'status':<12} {'items':>8} {'time (s)':>10}")
+    for state, crawler in crawlers.items():
+        spider_name = STATE_SPIDERS[state].name
+        elapsed = timer.elapsed(spider_name)
+        items = crawler.stats.get_value("item_scraped_count", 0)
+        reason = timer.reasons.get(spider_name, "not run")
+        elapsed = f"{elapsed:.1f}" if elapsed is not None else "-"
+        print(f"{state:<6} {reason:<12} {items:>8} {elapsed:>10}")
+    spiders_elapsed = sum(timer.elapsed(spider_name) or 0 for spider_name in timer.started)
+    print(f"Total: {total_elapsed:.1f}s (sum of spider times: {spiders_elapsed:.1f}s)")
+
+    if any(reason != "finished" for reason in timer.reasons.values()) or len(timer.reasons) < len(crawlers):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,20 +8,21 @@ from pathlib import Path
 
 import rows
 from async_process_executor import pipeline
-from rows.utils import load_schema
 from rows.utils.date import date_range, today
 from tqdm import tqdm
 
 from covid19br import demographics
+from covid19br.schemas import Schema
 
 DATA_PATH = Path(__file__).parent / "data"
 SCHEMA_PATH = Path(__file__).parent / "schema"
 
 
 def read_cases(input_filename, order_by=None):
-    cases = rows.import_from_csv(input_filename, force_types=load_schema(str(SCHEMA_PATH / "caso.csv")))
+    schema = Schema.from_file(SCHEMA_PATH / "caso.csv")
+    cases = list(schema.read_csv(input_filename, row_type=tuple))
     if order_by:
-        cases.order_by(order_by)
+        cases.sort(key=attrgetter(order_by))
     return cases
 
 
@@ -5,26 +5,13 @@ import sys
 from functools import partial
 
 from async_process_executor import pipeline
-from rows.utils import CsvLazyDictWriter, open_compressed
+from rows.utils import open_compressed
 from tqdm import tqdm
 
-from covid19br.elasticsearch import ElasticSearch
+from covid19br.elasticsearch import convert_rows, get_data_from_elasticsearch, write_csv
 from covid19br.vacinacao import convert_row_censored, convert_row_uncensored
 
 
-def get_data_from_elasticsearch(api_url, index_name, sort_by, username, password, page_size):
-    es = ElasticSearch(api_url)
-    iterator = es.paginate(index=index_name, sort_by=sort_by, user=username, password=password, page_size=page_size)
-    progress = tqdm(unit_scale=True)
-    progress.desc = f"Downloading page 001"
-    progress.refresh()
-    for page_number, page in enumerate(iterator, start=1):
-        progress.desc = f"Downloaded page {page_number:03d}"
-        progress.refresh()
-        yield page
-    progress.close()
-
-
 def get_data_from_csv(filename, page_size):
     with open_compressed(filename) as fobj:
         reader = csv.DictReader(fobj)
@@ -33,19 +20,6 @@ def get_data_from_csv(filename, page_size):
             yield page
 
 
-def convert_rows(func, iterator):
-    func = func if func is not None else lambda row: row
-    for page in iterator:
-        yield [func(row["_source"]) for row in page["hits"]["hits"]]
-
-
-def write_csv(filename, iterator):
-    writer = CsvLazyDictWriter(filename)
-    for page in iterator:
-        for row in page:
-            writer.writerow(row)
-
-
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--log-level", default="ERROR")
@@ -87,7 +61,7 @@ def main():
                 tuple(),
             ),
             (
-                write_csv,
+                partial(write_csv, write_metadata=True),
                 (args.output_filename,),
             ),
         ]
@@ -103,7 +77,7 @@ def main():
                 tuple(),
             ),
             (
-                write_csv,
+                partial(write_csv, write_metadata=True),
                 (args.output_filename,),
             ),
         ]
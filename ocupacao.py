@@ -1,66 +1,133 @@
 import argparse
 import datetime
+from functools import partial
 from pathlib import Path
 
-from rows.utils import CsvLazyDictWriter
-from tqdm import tqdm
+from async_process_executor import pipeline
 
-from covid19br.elasticsearch import ElasticSearch
+from covid19br.elasticsearch import convert_rows, get_data_from_elasticsearch, write_csv
 
 DOWNLOAD_PATH = Path(__file__).parent / "data" / "ocupacao"
 if not DOWNLOAD_PATH.exists():
     DOWNLOAD_PATH.mkdir(parents=True)
+BOOL_VALUES = {"true": True, "false": False, "sim": True, "não": False, "nao": False, "1": True, "0": False}
+
+
+def parse_str(value):
+    value = str(value if value is not None else "").strip()
+    return value or None
+
+
+def parse_int(value):
+    """
+    >>> parse_int("3.0"), parse_int(4), parse_int("") is None
+    (3, 4, True)
+    >>> parse_int("2.5")
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid integer value: '2.5'
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    value = parse_str(value)
+    if value is None:
+        return None
+    number = float(value)
+    if not number.is_integer():
+        raise ValueError(f"Invalid integer value: {repr(value)}")
+    return int(number)
+
+
+def parse_counter(value):
+    """Parse occupation counters (`float` in schema), keeping integers as `int`
+
+    >>> parse_counter(22)
+    22
+    >>> parse_counter("3.0")
+    3
+    >>> parse_counter("2.5")
+    2.5
+    >>> parse_counter("") is None
+    True
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    value = parse_str(value)
+    if value is None:
+        return None
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def parse_bool(value):
+    """
+    >>> parse_bool(True), parse_bool("false"), parse_bool("True"), parse_bool("")
+    (True, False, True, None)
+    >>> parse_bool("Sim"), parse_bool("não"), parse_bool(1), parse_bool("0")
+    (True, False, True, False)
+    """
+    if isinstance(value, bool):
+        return value
+    value = parse_str(value)
+    if value is None:
+        return None
+    try:
+        return BOOL_VALUES[value.lower()]
+    except KeyError:
+        raise ValueError(f"Invalid boolean value: {repr(value)}")
+
+
+def parse_datetime(value):
+    """
+    >>> parse_datetime("2020-08-11T03:00:07.102Z")
+    '2020-08-11T03:00:07.102000+00:00'
+    >>> parse_datetime(None) is None
+    True
+    """
+    value = parse_str(value)
+    if value is None:
+        return None
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    return datetime.datetime.fromisoformat(value).isoformat()
+
 
 FIELD_CONVERTERS = {
-    "estado": {"name": "", "converter": ""},
-    "estadoSigla": {"name": "", "converter": ""},
-    "municipio": {"name": "", "converter": ""},
-    "cnes": {"name": "", "converter": ""},
-    "dataNotificacaoOcupacao": {"name": "", "converter": ""},
-    "ocupHospCli": {"name": "", "converter": ""},
-    "ocupHospUti": {"name": "", "converter": ""},
-    "ocupSRAGCli": {"name": "", "converter": ""},
-    "ocupSRAGUti": {"name": "", "converter": ""},
-    "altas": {"name": "", "converter": ""},
-    "obitos": {"name": "", "converter": ""},
-    "ocupacaoInformada": {"name": "", "converter": ""},
-    "algumaOcupacaoInformada": {"name": "", "converter": ""},
-    "nomeCnes": {"name": "", "converter": ""},
-    "ofertaRespiradores": {"name": "", "converter": ""},
-    "ofertaHospCli": {"name": "", "converter": ""},
-    "ofertaHospUti": {"name": "", "converter": ""},
-    "ofertaSRAGCli": {"name": "", "converter": ""},
-    "ofertaSRAGUti": {"name": "", "converter": ""},
+    "estado": {"name": "estado", "converter": parse_str},
+    "estadoSigla": {"name": "estadosigla", "converter": parse_str},
+    "municipio": {"name": "municipio", "converter": parse_str},
+    "cnes": {"name": "cnes", "converter": parse_str},
+    "nomeCnes": {"name": "nomecnes", "converter": parse_str},
+    "dataNotificacaoOcupacao": {"name": "datanotificacaoocupacao", "converter": parse_datetime},
+    "ofertaRespiradores": {"name": "ofertarespiradores", "converter": parse_int},
+    "ofertaHospCli": {"name": "ofertahospcli", "converter": parse_int},
+    "ofertaHospUti": {"name": "ofertahosputi", "converter": parse_int},
+    "ofertaSRAGCli": {"name": "ofertasragcli", "converter": parse_int},
+    "ofertaSRAGUti": {"name": "ofertasraguti", "converter": parse_int},
+    "ocupHospCli": {"name": "ocuphospcli", "converter": parse_counter},
+    "ocupHospUti": {"name": "ocuphosputi", "converter": parse_counter},
+    "ocupSRAGCli": {"name": "ocupsragcli", "converter": parse_counter},
+    "ocupSRAGUti": {"name": "ocupsraguti", "converter": parse_counter},
+    "altas": {"name": "altas", "converter": parse_counter},
+    "obitos": {"name": "obitos", "converter": parse_counter},
+    "ocupacaoInformada": {"name": "ocupacaoinformada", "converter": parse_bool},
+    "algumaOcupacaoInformada": {"name": "algumaocupacaoinformada", "converter": parse_bool},
 }
+# Precomputed once so `convert_row` only does lookups and calls
+CONVERTER_PLAN = tuple((key, meta["name"], meta["converter"]) for key, meta in FIELD_CONVERTERS.items())
 
 
 def convert_row(row):
-    return {key: row.get(key, None) for key in FIELD_CONVERTERS.keys()}
-    # TODO: implement
-
-    # TODO: check municipio (correct name)
-    #    return {
-    #        "uf": row["estadoSigla"].upper(),
-    #        "municipio": row["municipio"],
-    #        "codigo_cnes": row["cnes"],
-    #        "nome": row["nomeCnes"],
-    #        'dataNotificacaoOcupacao': '2020-08-11T03:00:07.102Z',
-    #        'ofertaRespiradores': 0,
-    #        'ofertaHospCli': 86,
-    #        'ofertaHospUti': 0,
-    #        'ofertaSRAGCli': 12,
-    #        'ofertaSRAGUti': 0,
-    #        'ocupHospCli': 22,
-    #        'ocupHospUti': 3,
-    #        'ocupSRAGCli': 2,
-    #        'ocupSRAGUti': 3,
-    #        'altas': 0,
-    #        'obitos': 1,
-    #        'ocupacaoInformada': True,
-    #        'algumaOcupacaoInformada': True
-    #    }
-
-    return row
+    try:
+        return {name: converter(row.get(key, None)) for key, name, converter in CONVERTER_PLAN}
+    except ValueError:
+        # Find out which field has the invalid value (only when it fails)
+        for key, name, converter in CONVERTER_PLAN:
+            try:
+                converter(row.get(key, None))
+            except ValueError as exception:
+                raise ValueError(f"Cannot convert field {repr(key)}: {exception}") from exception
+        raise
 
 
 def main():
@@ -72,22 +139,27 @@ def main():
     parser.add_argument("--api-url", default="https://elastic-leitos.saude.gov.br/")
     parser.add_argument("--index", default="leito_ocupacao")
     parser.add_argument("--ttl", default="10m")
+    parser.add_argument("--page-size", type=int, default=10_000)
     parser.add_argument("--output-filename", default=DOWNLOAD_PATH / f"ocupacao-{dt}.csv")
     args = parser.parse_args()
 
-    es = ElasticSearch(args.api_url)
-    iterator = es.paginate(
-        index=args.index, sort_by="dataNotificacaoOcupacao", user=args.username, password=args.password, ttl=args.ttl,
-    )
-
-    writer = CsvLazyDictWriter(args.output_filename)
-    progress = tqdm(unit_scale=True)
-    for page_number, page in enumerate(iterator, start=1):
-        progress.desc = f"Downloading page {page_number}"
-        for row in page["hits"]["hits"]:
-            writer.writerow(convert_row(row["_source"]))
-            progress.update()
-    writer.close()
+    process_pipeline = [
+        (
+            get_data_from_elasticsearch,
+            (
+                args.api_url,
+                args.index,
+                "dataNotificacaoOcupacao",
+                args.username,
+                args.password,
+                args.page_size,
+                args.ttl,
+            ),
+        ),
+        (partial(convert_rows, convert_row), tuple()),
+        (write_csv, (args.output_filename,)),
+    ]
+    pipeline.execute(process_pipeline)
 
 
 if __name__ == "__main__":
@@ -1,35 +1,196 @@
+import argparse
 import csv
+import gzip
+import hashlib
+import io
+import os
 from itertools import groupby
+from multiprocessing import Pool, cpu_count
+from operator import itemgetter
 from pathlib import Path
 
-from rows.utils import CsvLazyDictWriter
 from tqdm import tqdm
 
+SCHEMA_FILENAME = Path(__file__).parent / "schema" / "ocupacao.csv"
+INDEX_FIELDNAMES = ("date", "filename", "size", "sha1", "schema_sha1", "offset", "length", "rows")
 
-def merge_files(filenames, output_filename):
-    groups = groupby(filenames, key=lambda row: row.name.split("T")[0].replace("ocupacao-", ""))
-    progress = tqdm()
-    writer = CsvLazyDictWriter(output_filename)
-    for index, (date, group) in enumerate(groups, start=1):
-        progress.desc = f"Processing file {index}"
-        group = sorted(group)
-        filename = group[-1]  # Process only the last file per day
-        dt = filename.name.split("ocupacao-")[1].split(".csv")[0]
-        base_row = {"datahora": dt}
-        with open(filename) as fobj:
-            reader = csv.DictReader(fobj)
+
+def read_field_names(schema_filename=SCHEMA_FILENAME):
+    with open(schema_filename) as fobj:
+        return [row["field_name"] for row in csv.DictReader(fobj)]
+
+
+def schema_sha1(field_names):
+    """Identify the output layout, so members are not reused after schema changes"""
+    return hashlib.sha1("\n".join(field_names).encode("utf-8")).hexdigest()
+
+
+def file_date(filename):
+    return filename.name.split("T")[0].replace("ocupacao-", "")
+
+
+def file_datetime(filename):
+    return filename.name.split("ocupacao-")[1].split(".csv")[0]
+
+
+def file_sha1(filename, chunk_size=1024 * 1024):
+    sha1 = hashlib.sha1()
+    with open(filename, mode="rb") as fobj:
+        for chunk in iter(lambda: fobj.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def last_file_per_day(filenames):
+    """Select only the last snapshot downloaded for each day"""
+    for date, group in groupby(sorted(filenames), key=file_date):
+        yield date, sorted(group)[-1]
+
+
+def make_row_getter(header, field_names):
+    """Build the header plan: a function converting a raw row into a tuple
+
+    The lowercase mapping is computed once per file; fields missing from
+    `header` (or from short rows) are filled with empty strings. Rows must
+    be lists.
+    """
+    positions = {key.lower(): index for index, key in enumerate(header)}
+    if all(field_name in positions for field_name in field_names) and len(field_names) > 1:
+        get_values = itemgetter(*(positions[field_name] for field_name in field_names))
+        row_length = max(positions[field_name] for field_name in field_names) + 1
+
+        def get_padded_values(row):
+            if len(row) < row_length:
+                row = row + [""] * (row_length - len(row))
+            return get_values(row)
+
+        return get_padded_values
+
+    plan = tuple(positions.get(field_name) for field_name in field_names)
+    return lambda row: tuple(row[index] if index is not None and index < len(row) else "" for index in plan)
+
+
+def write_csv_member(fobj, rows):
+    """Write `rows` as CSV into `fobj`, compressed as a single gzip member
+
+    Rows are compressed as they are written. Returns the number of rows.
+    """
+    count = 0
+    with gzip.GzipFile(filename="", fileobj=fobj, mode="wb") as gzip_fobj:
+        with io.TextIOWrapper(gzip_fobj, encoding="utf-8", newline="") as text_fobj:
+            writer = csv.writer(text_fobj, lineterminator="\n")
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+    return count
+
+
+def convert_file(args):
+    """Convert a day snapshot into a gzip member (without header)
+
+    Runs inside worker processes, so it must receive and return only
+    picklable objects.
+    """
+    filename, field_names = args
+    dt = file_datetime(filename)
+    output, ragged = io.BytesIO(), 0  # Only compressed data is kept in memory
+    with open(filename) as fobj:
+        reader = csv.reader(fobj)
+        header = next(reader, None)
+        if header is None:
+            return b"", 0, 0
+        get_values = make_row_getter(header, field_names)
+
+        def converted_rows():
+            nonlocal ragged
             for row in reader:
-                new = base_row.copy()
-                new.update({key.lower(): value for key, value in row.items()})
-                writer.writerow(new)
-                progress.update()
+                if len(row) != len(header):
+                    ragged += 1
+                yield (dt,) + get_values(row)
+
+        row_count = write_csv_member(output, converted_rows())
+    return output.getvalue(), row_count, ragged
+
+
+def read_index(filename):
+    if filename is None or not Path(filename).exists():
+        return {}
+    with open(filename) as fobj:
+        return {row["date"]: row for row in csv.DictReader(fobj)}
+
+
+def merge_files(filenames, output_filename, index_filename=None, workers=None):
+    """Merge the last snapshot of each day into one gzip-compressed CSV
+
+    Every day is written as an independent gzip member (concatenated gzip
+    members are a valid gzip file), so its byte range can be recorded in
+    `index_filename` and copied as-is from the previous output when the
+    snapshot did not change since the last run.
+    """
+    output_filename = Path(output_filename)
+    field_names = read_field_names()
+    value_field_names = tuple(field_names[1:])  # `datahora` comes from filename
+    layout_sha1 = schema_sha1(field_names)
+    old_index = read_index(index_filename) if output_filename.exists() else {}
+
+    days = []
+    for date, filename in last_file_per_day(filenames):
+        size, sha1 = filename.stat().st_size, file_sha1(filename)
+        old = old_index.get(date)
+        reuse = old is not None and (old["filename"], old["size"], old["sha1"], old.get("schema_sha1")) == (
+            filename.name,
+            str(size),
+            sha1,
+            layout_sha1,
+        )
+        days.append((date, filename, size, sha1, old if reuse else None))
+    to_convert = [(filename, value_field_names) for _, filename, _, _, old in days if old is None]
+
+    temp_filename = output_filename.parent / f".{output_filename.name}.tmp"
+    new_index = []
+    progress = tqdm(total=len(days), unit="file")
+    old_fobj = open(output_filename, mode="rb") if len(to_convert) < len(days) else None
+    with Pool(processes=workers or cpu_count()) as pool, open(temp_filename, mode="wb") as fobj:
+        converted = pool.imap(convert_file, to_convert)
+        write_csv_member(fobj, [field_names])
+        for date, filename, size, sha1, old in days:
+            progress.desc = f"Processing {filename.name}"
+            offset = fobj.tell()
+            if old is not None:
+                old_fobj.seek(int(old["offset"]))
+                fobj.write(old_fobj.read(int(old["length"])))
+                row_count = int(old["rows"])
+            else:
+                data, row_count, ragged = next(converted)
+                fobj.write(data)
+                if ragged:
+                    tqdm.write(f"WARNING: {ragged} rows in {filename.name} do not match the header length")
+            new_index.append((date, filename.name, size, sha1, layout_sha1, offset, fobj.tell() - offset, row_count))
+            progress.update()
+    if old_fobj is not None:
+        old_fobj.close()
     progress.close()
-    writer.close()
+    os.replace(temp_filename, output_filename)
+
+    if index_filename is not None:
+        with open(index_filename, mode="w") as fobj:
+            writer = csv.writer(fobj, lineterminator="\n")
+            writer.writerow(INDEX_FIELDNAMES)
+            writer.writerows(new_index)
 
 
 if __name__ == "__main__":
     DOWNLOAD_PATH = Path("data/ocupacao")
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    parser.add_argument("--output-filename", default=DOWNLOAD_PATH / "ocupacao.csv.gz")
+    parser.add_argument("--index-filename", default=DOWNLOAD_PATH / "ocupacao-index.csv")
+    args = parser.parse_args()
+
     merge_files(
-        filenames=sorted(DOWNLOAD_PATH.glob("ocupacao-*.csv")), output_filename=DOWNLOAD_PATH / "ocupacao.csv.gz",
+        filenames=DOWNLOAD_PATH.glob("ocupacao-[0-9]*.csv"),
+        output_filename=Path(args.output_filename),
+        index_filename=args.index_filename,
+        workers=args.workers,
     )
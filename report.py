@@ -3,75 +3,119 @@ import csv
 import datetime
 import gzip
 import io
-import json
-from collections import Counter
-from itertools import groupby
+from collections import defaultdict
 from pathlib import Path
-from urllib.parse import urlencode
-from urllib.request import Request, urlopen
 
-from rows.fields import make_header
-from rows.utils import load_schema
+from covid19br.brasilio import BrasilIO, BrasilIOError
 
 BASE_DIR = Path(__file__).parent
 
 
-def sum_all(data, key):
-    return sum(row[key] for row in data if row[key] is not None)
+def parse_number(value):
+    # API returns integers, CSV returns strings ("" for null)
+    return int(value) if value not in (None, "") else None
 
 
-class Schema:  # TODO: add this class to rows
-    @classmethod
-    def from_file(cls, filename):
-        obj = cls()
-        obj.filename = filename
-        obj.fields = load_schema(str(filename))  # TODO: load_schema must support Path objects
-        return obj
+def is_true(value):
+    return value is True or value == "True"
 
-    def deserialize(self, row):
-        field_names = list(row.keys())
-        field_mapping = {old: self.fields[new] for old, new in zip(field_names, make_header(field_names))}
-        return {key: field_mapping[key].deserialize(value) for key, value in row.items()}
 
-
-def get_brasilio_data(dataset, table, **filters):
-    url = f"https://brasil.io/api/dataset/{dataset}/{table}/data/"
-    if "page_size" not in filters:
-        filters["page_size"] = 10_000
-    if filters:
-        url += "?" + urlencode(filters)
-
-    finished = False
-    data = []
-    while not finished:
-        try:
-            request = Request(url, headers={"User-Agent": "brasilio-covid19-scraper"})
-            response = urlopen(request)
-        except Exception:
-            import traceback
-
-            print(f"ERROR while downloading {url}")
-            traceback.print_exc()
-            exit(1)
-        response_data = json.loads(response.read())
-        data.extend(response_data["results"])
-        url = response_data["next"]
-        if not url:
-            finished = True
-    return data
+def get_brasilio_data(client, dataset, table, **filters):
+    try:
+        yield from client.data(dataset, table, **filters)
+    except BrasilIOError as exception:
+        print(f"ERROR: {exception}")
+        exit(1)
 
 
 def get_local_data(table):
-    schema = Schema.from_file(BASE_DIR / "schema" / f"{table}.csv")
+    """Yield raw rows (not deserialized) from the local CSV output"""
     filename = BASE_DIR / "data" / "output" / f"{table}.csv.gz"
     with io.TextIOWrapper(gzip.GzipFile(filename), encoding="utf-8") as fobj:
-        return [schema.deserialize(row) for row in csv.DictReader(fobj)]
-
-
-def filter_rows(data, **kwargs):
-    for row in data:
-        if all(row[key] == value for key, value in kwargs.items()):
-            yield row
+        yield from csv.DictReader(fobj)
+
+
+class PlaceTotals:
+    def __init__(self):
+        self.rows = self.confirmed = self.deaths = 0
+        self.date = None
+
+    def add(self, date, confirmed, deaths):
+        self.rows += 1
+        if confirmed is not None:
+            self.confirmed += confirmed
+        if deaths is not None:
+            self.deaths += deaths
+        if self.date is None or date > self.date:
+            self.date = date
+
+
+class CasoReport:
+    """Aggregate everything the report needs in a single pass over `caso`
+
+    Works with raw rows (strings from CSV or values from the API): dates are
+    compared as ISO strings and only the needed values are converted.
+    """
+
+    def __init__(self):
+        self.last_date = None
+        self.state_last_date = {}
+        self.state_totals = defaultdict(PlaceTotals)  # Last state rows, per state
+        self.city_totals = defaultdict(PlaceTotals)  # Last city rows, per state
+        self.city_dates = defaultdict(lambda: defaultdict(list))  # state → date → cities (last rows)
+
+    def add(self, row):
+        state, date = row["state"], str(row["date"])
+        if self.last_date is None or date > self.last_date:
+            self.last_date = date
+        if state not in self.state_last_date or date > self.state_last_date[state]:
+            self.state_last_date[state] = date
+        if not is_true(row["is_last"]):
+            return
+
+        confirmed, deaths = parse_number(row["confirmed"]), parse_number(row["deaths"])
+        if row["place_type"] == "state":
+            self.state_totals[state].add(date, confirmed, deaths)
+        elif row["place_type"] == "city":
+            self.city_totals[state].add(date, confirmed, deaths)
+            self.city_dates[state][date].append(row["city"])
+
+    def consume(self, data):
+        for row in data:
+            self.add(row)
+        return self
+
+    def total(self, totals, key):
+        return sum(getattr(place_totals, key) for place_totals in totals.values())
+
+    def state_checks(self, state):
+        """Return `(state_date, confirmed_diff, deaths_diff)` messages for a state"""
+        state_date = self.state_last_date[state]
+        state_totals = self.state_totals.get(state)
+        if state_totals is None:
+            confirmed_state = deaths_state = None
+        else:
+            confirmed_state, deaths_state = state_totals.confirmed, state_totals.deaths
+            state_date = state_totals.date
+        city_totals = self.city_totals.get(state) or PlaceTotals()
+        confirmed_cities, deaths_cities = city_totals.confirmed, city_totals.deaths
+
+        city_dates = self.city_dates.get(state, {})
+        if len(city_dates) > 1:
+            wrong_cities = [
+                f"{city} ({date})" for date, cities in city_dates.items() if date != state_date for city in cities
+            ]
+            wrong_str = " - municípios: " + ", ".join(sorted(wrong_cities))
+        else:
+            wrong_str = ""
+        confirmed_diff = deaths_diff = None
+        if confirmed_state != confirmed_cities:
+            confirmed_diff = f"{state} ({confirmed_cities}/{confirmed_state}){wrong_str}"
+        elif wrong_str:
+            confirmed_diff = f"{state} {wrong_str}"
+        if deaths_state != deaths_cities:
+            deaths_diff = f"{state} ({deaths_cities}/{deaths_state})"
+        return state_date, confirmed_diff, deaths_diff
 
 
 def print_stats(title, data):
@@ -86,73 +130,47 @@ def print_stats(title, data):
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--cache-path", default=str(BASE_DIR / "data" / "cache" / "brasilio"))
+    parser.add_argument("--cache-ttl", type=int, default=600, help="API response cache TTL (seconds, 0 to disable)")
+    parser.add_argument("--workers", type=int, default=4, help="Number of pages to download concurrently")
     parser.add_argument("source", choices=["api", "local"])
     args = parser.parse_args()
 
     if args.source == "api":
-        boletins = get_brasilio_data("covid19", "boletim", is_last=True)
-        casos = get_brasilio_data("covid19", "caso", is_last=True)
+        client = BrasilIO(
+            cache_path=args.cache_path if args.cache_ttl > 0 else None,
+            cache_ttl=args.cache_ttl,
+            max_workers=args.workers,
+        )
+        boletins = get_brasilio_data(client, "covid19", "boletim", is_last=True)
+        casos = get_brasilio_data(client, "covid19", "caso", is_last=True)
     elif args.source == "local":
         boletins = get_local_data("boletim")
         casos = get_local_data("caso")
 
-    state_rows = list(filter_rows(casos, is_last=True, place_type="state"))
-    city_rows = list(filter_rows(casos, is_last=True, place_type="city"))
-
-    confirmados_estados = sum_all(state_rows, "confirmed")
-    confirmados_municipios = sum_all(city_rows, "confirmed")
-    mortes_estados = sum_all(state_rows, "deaths")
-    mortes_municipios = sum_all(city_rows, "deaths")
+    total_boletins = sum(1 for _ in boletins)
+    report = CasoReport().consume(casos)
     print_stats(
         "últimos dados",
         [
-            f"{len(boletins)} boletins capturados",
-            f"{confirmados_estados} casos confirmados (estado)",
-            f"{confirmados_municipios} casos confirmados (municípios)",
-            f"{mortes_estados} mortes (estado)",
-            f"{mortes_municipios} mortes (municípios)",
+            f"{total_boletins} boletins capturados",
+            f"{report.total(report.state_totals, 'confirmed')} casos confirmados (estado)",
+            f"{report.total(report.city_totals, 'confirmed')} casos confirmados (municípios)",
+            f"{report.total(report.state_totals, 'deaths')} mortes (estado)",
+            f"{report.total(report.city_totals, 'deaths')} mortes (municípios)",
         ],
     )
 
-    casos.sort(key=lambda row: row["date"], reverse=True)
-    last_date = casos[0]["date"]
-    casos.sort(key=lambda row: row["state"])
+    last_date = report.last_date
     confirmed_diff, deaths_diff, updated_diff = [], [], []
-    for state, data in groupby(casos, key=lambda row: row["state"]):
-        data = list(data)
-        state_date = max(row["date"] for row in data)
-        state_rows = list(filter_rows(data, is_last=True, place_type="state"))
-        city_rows = list(filter_rows(data, is_last=True, place_type="city"))
-        if not state_rows:
-            confirmed_state = None
-            deaths_state = None
-        else:
-            confirmed_state = sum_all(state_rows, "confirmed")
-            deaths_state = sum_all(state_rows, "deaths")
-            state_date = state_rows[0]["date"]
-
-        confirmed_cities = sum_all(city_rows, "confirmed")
-        deaths_cities = sum_all(city_rows, "deaths")
-
-        confirmed_differs = confirmed_state != confirmed_cities
-        deaths_differs = deaths_state != deaths_cities
-        date_count = Counter(row["date"] for row in city_rows)
-        if len(date_count) > 1:
-            wrong_cities = []
-            for date, _ in date_count.most_common():
-                if date != state_date:
-                    wrong_cities.extend(list(filter_rows(city_rows, date=date)))
-            wrong_str = " - municípios: " + ", ".join(sorted(f"{row['city']} ({row['date']})" for row in wrong_cities))
-        else:
-            wrong_str = ""
-        if confirmed_differs:
-            confirmed_diff.append(f"{state} ({confirmed_cities}/{confirmed_state}){wrong_str}")
-        elif wrong_str:
-            confirmed_diff.append(f"{state} {wrong_str}")
-        if deaths_differs:
-            deaths_diff.append(f"{state} ({deaths_cities}/{deaths_state})")
+    for state in sorted(report.state_last_date):
+        state_date, state_confirmed_diff, state_deaths_diff = report.state_checks(state)
+        if state_confirmed_diff:
+            confirmed_diff.append(state_confirmed_diff)
+        if state_deaths_diff:
+            deaths_diff.append(state_deaths_diff)
         if state_date != last_date:
-            dias = abs(datetime.date.fromisoformat(str(state_date)) - datetime.date.fromisoformat(str(last_date))).days
+            dias = abs(datetime.date.fromisoformat(state_date) - datetime.date.fromisoformat(last_date)).days
             msg_atraso = f" - *{dias} dias de atraso*" if dias >= 2 else ""
             updated_diff.append(f"{state} ({state_date}){msg_atraso}")
     print_stats("desatualizados", updated_diff)
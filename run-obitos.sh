@@ -9,10 +9,10 @@ FINAL_FILENAME="$OUTPUT_PATH/obito_cartorio.csv.gz"
 rm -rf "$OUTPUT_FILENAME" "$FINAL_FILENAME"
 mkdir -p "$DOWNLOAD_PATH" "$OUTPUT_PATH" "$LOG_PATH"
 time scrapy runspider covid19br/spiders/obitos_spider.py \
-	-s HTTPCACHE_ENABLED=True \
-	-s HTTPCACHE_ALWAYS_STORE=True \
-	-s HTTPCACHE_IGNORE_HTTP_CODES=500,504 \
+	-s REGISTRO_CIVIL_CACHE="$DOWNLOAD_PATH/registro-civil-cache.sqlite" \
+	-s REGISTRO_CIVIL_CACHE_HORIZON=30 \
 	-s AUTOTHROTTLE_ENABLED=True \
+	-s REGISTRO_CIVIL_CONCURRENCY=8 \
 	-s RETRY_TIMES=4 \
 	--loglevel=INFO \
 	--logfile="$LOG_PATH/obitos.log" \
@@ -4,14 +4,12 @@ set -e
 SCRIPT_PATH=$(dirname ${BASH_SOURCE[0]})
 source $SCRIPT_PATH/base.sh
 
+# All state spiders run concurrently in the same process (see
+# `covid19br/spiders/run_states.py`), each one with its own CSV and log file.
 mkdir -p $DOWNLOAD_PATH $OUTPUT_PATH $LOG_PATH
-for state in ce pr sp; do
-	log_filename="$LOG_PATH/caso-${state}.log"
-	csv_filename="$OUTPUT_PATH/caso-${state}.csv"
-	rm -rf "$log_filename" "$csv_filename"
-	time scrapy runspider \
-		--loglevel=INFO \
-		--logfile="$log_filename" \
-		-o "$csv_filename" \
-		covid19br/spiders/corona_${state}_spider.py
-done
+time python -m covid19br.spiders.run_states \
+	--log-level=INFO \
+	--output-path="$OUTPUT_PATH" \
+	--download-path="$DOWNLOAD_PATH" \
+	--log-path="$LOG_PATH" \
+	ce pr sp
@@ -1,10 +1,14 @@
 import argparse
+import csv
 import datetime
-from collections import Counter
+import heapq
+import tempfile
 from functools import lru_cache
 from itertools import groupby
+from operator import itemgetter
 
 import rows
+from rows.utils import ipartition, open_compressed
 from rows.utils.date import today
 from tqdm import tqdm
 
@@ -42,102 +46,165 @@ def year_causes_keys(prefix, years):
     return result
 
 
-def convert_file(filename):
+def all_keys():
     # There are some missing data on the registral, so default all to None
     # Multiple passes to keep the same column ordering
-    all_keys = []
+    keys = []
     for prefix in PREFIX_CHOICES:
-        all_keys.extend(year_causes_keys(prefix, YEAR_CHOICES))
-        all_keys.extend([f"{prefix}_total_{year}" for year in YEAR_CHOICES])
-    base_row = {}
-    for key in all_keys:
-        base_row[key] = 0 if key.startswith("deaths_") else None
-
-    table_types = {
-        "date": rows.fields.DateField,
-        "state": rows.fields.TextField,
-        "cause": rows.fields.TextField,
-        "total": rows.fields.IntegerField,
-    }
-    table = rows.import_from_csv(filename, force_types=table_types)
-    row_key = lambda row: (row.state, datetime.date(2020, row.date.month, row.date.day))
-    table = sorted(table, key=row_key)
-    accumulated = Counter()
-    last_day = today()
-    for key, state_data in groupby(table, key=row_key):
-        state, date = key
-        row = {
-            "date": date,
-            "state": state,
-        }
+        keys.extend(year_causes_keys(prefix, YEAR_CHOICES))
+        keys.extend([f"{prefix}_total_{year}" for year in YEAR_CHOICES])
+    return keys
+
+
+def epidemiological_week_table():
+    """Precompute epidemiological weeks for each day of the year (as "MM-DD")
+
+    Values are (week in 2019, week in 2020). 29 February does not exist in
+    2019, so the previous day is used for it.
+    """
+    table = {}
+    date = datetime.date(2020, 1, 1)
+    while date.year == 2020:
         try:
             this_day_in_2019 = datetime.date(2019, date.month, date.day)
         except ValueError:  # This day does not exist in 2019 (29 February)
             yesterday = date - one_day
             this_day_in_2019 = datetime.date(2019, yesterday.month, yesterday.day)
-        row["epidemiological_week_2019"] = brazilian_epidemiological_week(this_day_in_2019)[1]
-        row["epidemiological_week_2020"] = brazilian_epidemiological_week(date)[1]
-        row.update(base_row)
-
-        # Zero sum of new deaths for this state in all years (will accumulate)
-        for year in YEAR_CHOICES:
-            accumulated[(year, state, "new-total")] = 0
-
-        # For each death cause in this date/state, fill `row` and accumulate
-        filled_causes = set()
-        for item in state_data:
-            cause = item.cause
-            year = item.date.year
+        table[date.strftime("%m-%d")] = (
+            brazilian_epidemiological_week(this_day_in_2019)[1],
+            brazilian_epidemiological_week(date)[1],
+        )
+        date += one_day
+    return table
+
+
+def read_rows(filename):
+    """Read (state, month-day, year, cause, total) tuples from the raw CSV"""
+    with open_compressed(filename) as fobj:
+        reader = csv.reader(fobj)
+        header = next(reader)
+        date_index, state_index = header.index("date"), header.index("state")
+        cause_index, total_index = header.index("cause"), header.index("total")
+        for row in reader:
+            date = row[date_index]
+            yield (row[state_index], date[5:10], int(date[:4]), row[cause_index], int(row[total_index] or 0))
+
+
+def external_sort(iterator, chunk_size=100_000):
+    """Sort `iterator` using temporary files, so memory use is bounded by `chunk_size`"""
+    chunk_files = []
+    try:
+        for chunk in ipartition(iterator, chunk_size):
+            chunk.sort()
+            fobj = tempfile.TemporaryFile(mode="w+", newline="")
+            csv.writer(fobj).writerows(chunk)
+            fobj.seek(0)
+            chunk_files.append(fobj)
+
+        yield from heapq.merge(*(map(parse_sorted_row, csv.reader(fobj)) for fobj in chunk_files))
+    finally:
+        for fobj in chunk_files:
+            fobj.close()
+
+
+def parse_sorted_row(row):
+    state, month_day, year, cause, total = row
+    return state, month_day, int(year), cause, int(total)
+
+
+def convert_file(filename, presorted=False, chunk_size=100_000):
+    """Convert the raw deaths CSV into one row per (state, date), streaming
+
+    The input must be ordered by state and month-day (the same day in 2019
+    and 2020 are grouped together): if it's not `presorted` an external
+    sort is done first. Only the counters for the current state are kept in
+    memory, as fixed-size arrays indexed by (year, cause).
+    """
+    header = ["date", "state", "epidemiological_week_2019", "epidemiological_week_2020"] + all_keys()
+    position = {key: index for index, key in enumerate(header)}
+    base_values = [None] * len(header)
+    for key in header:
+        if key.startswith("deaths_"):
+            base_values[position[key]] = 0
+
+    years = {year: index for index, year in enumerate(YEAR_CHOICES)}
+    causes = {cause: index for index, cause in enumerate(RESPIRATORY_DEATH_CAUSES)}
+    # (year index, cause index) -> (position of new_deaths_*, position of deaths_*)
+    cause_positions = {}
+    for year, year_index in years.items():
+        for cause, cause_index in causes.items():
             key_new = get_death_cause_key("new_deaths", cause, year)
-            new_deaths = item.total
-            if key_new is None:
+            if key_new is not None:
+                cause_positions[(year_index, cause_index)] = (
+                    position[key_new],
+                    position[get_death_cause_key("deaths", cause, year)],
+                )
+    total_positions = [
+        (
+            position[get_death_cause_key("new_deaths", "total", year)],
+            position[get_death_cause_key("deaths", "total", year)],
+        )
+        for year in YEAR_CHOICES
+    ]
+    epiweeks = epidemiological_week_table()
+    last_day = today()
+
+    iterator = read_rows(filename)
+    if not presorted:
+        iterator = external_sort(iterator, chunk_size=chunk_size)
+
+    current_state, accumulated, totals = None, None, None
+    for (state, month_day), group in groupby(iterator, key=itemgetter(0, 1)):
+        if state != current_state:  # Counters are per state
+            current_state = state
+            accumulated = [[0] * len(causes) for _ in years]
+            totals = [0] * len(years)
+        date = datetime.date(2020, int(month_day[:2]), int(month_day[3:]))
+        values = base_values.copy()
+        values[0], values[1] = str(date), state
+        values[2], values[3] = epiweeks[month_day]
+
+        # For each death cause in this date/state, fill `values` and accumulate
+        new_totals = [0] * len(years)
+        for _, _, year, cause, new_deaths in group:
+            year_index, cause_index = years[year], causes[cause]
+            positions = cause_positions.get((year_index, cause_index))
+            if positions is None:
                 if new_deaths > 0:
-                    # raise RuntimeError(f"Cannot have new_deaths > 0 when key for (new_deaths, {cause}, {year}) is None")
+                    item = (state, month_day, year, cause, new_deaths)
                     print(f"ERROR converting {item}: new_deaths > 0 but key is None")
-                    continue
-                else:
-                    continue
-            accumulated_key = (year, state, cause)
-            accumulated_key_total = (year, state, "total")
-            accumulated_key_new_total = (year, state, "new-total")
-            accumulated[accumulated_key] += new_deaths
-            accumulated[accumulated_key_total] += new_deaths
-            accumulated[accumulated_key_new_total] += new_deaths
-            row[key_new] = new_deaths
-            row[get_death_cause_key("deaths", cause, year)] = accumulated[accumulated_key]
-            filled_causes.add((year, cause))
-
-        # Fill other deaths_* (accumulated) values with the last available data
-        # if not filled by the state_data for this date.
-        for cause in RESPIRATORY_DEATH_CAUSES:
-            for year in YEAR_CHOICES:
-                if (year, cause) in filled_causes:
-                    continue
-                accumulated_key = (year, state, cause)
-                key_name = get_death_cause_key("deaths", cause, year)
-                if key_name is None:
-                    continue
-                row[key_name] = accumulated[accumulated_key]
+                continue
+            accumulated[year_index][cause_index] += new_deaths
+            totals[year_index] += new_deaths
+            new_totals[year_index] += new_deaths
+            values[positions[0]] = new_deaths
+
+        # Fill deaths_* (accumulated) values, including the ones without data
+        # for this date (last available data).
+        for (year_index, cause_index), (_, deaths_position) in cause_positions.items():
+            values[deaths_position] = accumulated[year_index][cause_index]
 
         # Fill year totals (new and accumulated) for state
-        for year in YEAR_CHOICES:
+        for year, year_index in years.items():
+            new_total_position, total_position = total_positions[year_index]
             if year == last_day.year and date > last_day:
-                new_total = None
+                values[new_total_position] = None
             else:
-                new_total = accumulated[(year, state, "new-total")]
-            total = accumulated[(year, state, "total")]
-            row[get_death_cause_key("new_deaths", "total", year)] = new_total
-            row[get_death_cause_key("deaths", "total", year)] = total
+                values[new_total_position] = new_totals[year_index]
+            values[total_position] = totals[year_index]
 
-        yield row
+        yield dict(zip(header, values))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
+    parser.add_argument("--presorted", action="store_true", help="Input is already sorted by state and month-day")
+    parser.add_argument("--chunk-size", type=int, default=100_000, help="Rows per chunk for the external sort")
     parser.add_argument("input_filename")
     parser.add_argument("output_filename")
     args = parser.parse_args()
 
     writer = rows.utils.CsvLazyDictWriter(args.output_filename)
-    for row in tqdm(convert_file(args.input_filename)):
+    for row in tqdm(convert_file(args.input_filename, presorted=args.presorted, chunk_size=args.chunk_size)):
         writer.writerow(row)
+    writer.close()
@@ -14,34 +14,204 @@ CREATE INDEX IF NOT EXISTS idx_caso_full_key ON caso_full (
 );
 UPDATE caso_full SET city = '' WHERE place_type = 'state';  /* Remove NULLs */
 
-DROP VIEW IF EXISTS all_dates;
-CREATE VIEW all_dates AS
+/* Aggregates are materialized in indexed tables, kept between runs. Only
+   dates whose `caso_full` rows changed (new, revised or removed dates) are
+   recalculated: `refresh_date` and `refresh_week` list them for the other
+   setup files. The fingerprints of the source rows (per date, state and
+   place type) are saved only by the last setup file, after all aggregates
+   were refreshed, so an interrupted setup is refreshed again next time. */
+CREATE TABLE IF NOT EXISTS materialized_fingerprint (
+	date TEXT,
+	state TEXT,
+	place_type TEXT,
+	epidemiological_week INTEGER,
+	rows INTEGER,
+	confirmed INTEGER,
+	deaths INTEGER,
+	new_confirmed INTEGER,
+	new_deaths INTEGER,
+	city_ibge_codes INTEGER,
+	population INTEGER,
+	city_names_length INTEGER,
+	PRIMARY KEY (date, state, place_type)
+);
+
+DROP TABLE IF EXISTS source_fingerprint;
+CREATE TABLE source_fingerprint AS
+	SELECT
+		date,
+		state,
+		place_type,
+		MAX(epidemiological_week) AS epidemiological_week,
+		COUNT(*) AS rows,
+		SUM(last_available_confirmed) AS confirmed,
+		SUM(last_available_deaths) AS deaths,
+		SUM(new_confirmed) AS new_confirmed,
+		SUM(new_deaths) AS new_deaths,
+		SUM(city_ibge_code) AS city_ibge_codes,
+		SUM(estimated_population_2019) AS population,
+		SUM(LENGTH(city)) AS city_names_length
+	FROM caso_full
+	GROUP BY
+		date,
+		state,
+		place_type;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_source_fingerprint_key ON source_fingerprint (
+	date,
+	state,
+	place_type
+);
+
+DROP TABLE IF EXISTS source_date;
+CREATE TABLE source_date AS
 	SELECT
 		DISTINCT date
-	FROM
-		caso
-	ORDER BY
-		date ASC;
+	FROM source_fingerprint;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_source_date ON source_date (date);
 
-DROP VIEW IF EXISTS all_places;
-CREATE VIEW all_places AS
+DROP TABLE IF EXISTS changed_fingerprint;
+CREATE TEMP TABLE changed_fingerprint AS
+	SELECT
+		s.date,
+		s.epidemiological_week AS new_epidemiological_week,
+		m.epidemiological_week AS old_epidemiological_week
+	FROM source_fingerprint AS s
+		LEFT JOIN materialized_fingerprint AS m
+			ON
+				m.date = s.date
+				AND m.state = s.state
+				AND m.place_type = s.place_type
+	WHERE
+		m.date IS NULL
+		OR m.epidemiological_week IS NOT s.epidemiological_week
+		OR m.rows IS NOT s.rows
+		OR m.confirmed IS NOT s.confirmed
+		OR m.deaths IS NOT s.deaths
+		OR m.new_confirmed IS NOT s.new_confirmed
+		OR m.new_deaths IS NOT s.new_deaths
+		OR m.city_ibge_codes IS NOT s.city_ibge_codes
+		OR m.population IS NOT s.population
+		OR m.city_names_length IS NOT s.city_names_length
+	UNION ALL
+	SELECT
+		m.date,
+		NULL AS new_epidemiological_week,
+		m.epidemiological_week AS old_epidemiological_week
+	FROM materialized_fingerprint AS m
+		LEFT JOIN source_fingerprint AS s
+			ON
+				m.date = s.date
+				AND m.state = s.state
+				AND m.place_type = s.place_type
+	WHERE
+		s.date IS NULL;
+
+DROP TABLE IF EXISTS refresh_date;
+CREATE TABLE refresh_date AS
+	SELECT
+		DISTINCT date
+	FROM changed_fingerprint;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_refresh_date ON refresh_date (date);
+
+DROP TABLE IF EXISTS refresh_week;
+CREATE TABLE refresh_week AS
+	SELECT new_epidemiological_week AS epidemiological_week FROM changed_fingerprint
+	WHERE new_epidemiological_week IS NOT NULL
+	UNION
+	SELECT old_epidemiological_week AS epidemiological_week FROM changed_fingerprint
+	WHERE old_epidemiological_week IS NOT NULL;
+
+BEGIN;
+
+/* Places may appear or disappear only on refreshed dates */
+CREATE TABLE IF NOT EXISTS place (
+	state TEXT,
+	city TEXT,
+	place_type TEXT,
+	city_ibge_code INTEGER,
+	estimated_population_2019 INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_place_key ON place (
+	state,
+	city,
+	place_type
+);
+DROP TABLE IF EXISTS old_place;
+CREATE TEMP TABLE old_place AS SELECT * FROM place;
+DELETE FROM place WHERE (SELECT COUNT(*) FROM refresh_date) > 0;
+INSERT INTO place
 	SELECT
 		state,
 		city,
 		place_type,
 		city_ibge_code,
 		estimated_population_2019
-	FROM
-		caso_full
+	FROM caso_full
+	WHERE
+		(SELECT COUNT(*) FROM refresh_date) > 0
 	GROUP BY
 		state,
 		city,
 		place_type,
 		city_ibge_code,
 		estimated_population_2019;
+DROP TABLE IF EXISTS new_place;
+CREATE TEMP TABLE new_place AS
+	SELECT * FROM place
+	EXCEPT
+	SELECT * FROM old_place;
+DROP TABLE IF EXISTS removed_place;
+CREATE TEMP TABLE removed_place AS
+	SELECT * FROM old_place
+	EXCEPT
+	SELECT * FROM place;
 
-DROP VIEW IF EXISTS place_date_matrix;
-CREATE VIEW place_date_matrix AS
+/* Place x date matrix: refreshed dates x all places + other dates x new places */
+CREATE TABLE IF NOT EXISTS place_date (
+	date TEXT,
+	state TEXT,
+	city TEXT,
+	place_type TEXT,
+	city_ibge_code INTEGER,
+	estimated_population_2019 INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_place_date_key ON place_date (
+	date,
+	state,
+	city,
+	place_type
+);
+CREATE INDEX IF NOT EXISTS idx_place_date_place ON place_date (
+	state,
+	city,
+	place_type
+);
+DELETE FROM place_date WHERE date IN (SELECT date FROM refresh_date);
+DELETE FROM place_date
+	WHERE
+		EXISTS (
+			SELECT 1
+			FROM removed_place AS p
+			WHERE
+				p.state = place_date.state
+				AND p.city = place_date.city
+				AND p.place_type = place_date.place_type
+				AND p.city_ibge_code IS place_date.city_ibge_code
+				AND p.estimated_population_2019 IS place_date.estimated_population_2019
+		);
+INSERT INTO place_date
+	SELECT
+		d.date,
+		p.state,
+		p.city,
+		p.place_type,
+		p.city_ibge_code,
+		p.estimated_population_2019
+	FROM source_date AS d
+		JOIN place AS p
+	WHERE
+		d.date IN (SELECT date FROM refresh_date)
+	UNION ALL
 	SELECT
 		d.date,
 		p.state,
@@ -49,8 +219,67 @@ CREATE VIEW place_date_matrix AS
 		p.place_type,
 		p.city_ibge_code,
 		p.estimated_population_2019
-	FROM all_dates AS d
-		JOIN all_places AS p;
+	FROM source_date AS d
+		JOIN new_place AS p
+	WHERE
+		d.date NOT IN (SELECT date FROM refresh_date);
+
+COMMIT;
+
+DROP VIEW IF EXISTS all_dates;
+CREATE VIEW all_dates AS
+	SELECT
+		date
+	FROM
+		source_date
+	ORDER BY
+		date ASC;
+
+DROP VIEW IF EXISTS all_places;
+CREATE VIEW all_places AS
+	SELECT
+		*
+	FROM
+		place;
+
+DROP VIEW IF EXISTS place_date_matrix;
+CREATE VIEW place_date_matrix AS
+	SELECT
+		*
+	FROM
+		place_date;
+
+/* State totals depend only on the last rows (`is_last`), so they are small
+   and always rebuilt */
+DROP TABLE IF EXISTS state_total;
+CREATE TABLE state_total AS
+	SELECT
+		s.state,
+		c.confirmed AS confirmed_cities,
+		c.deaths AS deaths_cities,
+		s.confirmed AS confirmed_state,
+		s.deaths AS deaths_state
+	FROM (
+		SELECT
+			state,
+			SUM(confirmed) AS confirmed,
+			SUM(deaths) AS deaths
+		FROM caso
+		WHERE
+			is_last = 'True'
+			AND place_type = 'city'
+		GROUP BY
+			state
+	) AS c
+		JOIN caso AS s
+		ON
+			c.state = s.state
+	WHERE
+		s.is_last = 'True'
+		AND s.place_type = 'state'
+	ORDER BY
+		s.state;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_state_total_state ON state_total (state);
 
 DROP VIEW IF EXISTS total_state_from_cities;
 CREATE VIEW total_state_from_cities AS
@@ -85,15 +314,8 @@ CREATE VIEW total_state_from_states AS
 DROP VIEW IF EXISTS total_from_state_and_cities;
 CREATE VIEW total_from_state_and_cities AS
 	SELECT
-		c.state,
-		c.confirmed AS confirmed_cities,
-		c.deaths AS deaths_cities,
-		s.confirmed AS confirmed_state,
-		s.deaths AS deaths_state
-	FROM total_state_from_cities AS c
-		JOIN total_state_from_states AS s
-		ON
-			c.state = s.state;
+		*
+	FROM state_total;
 
 DROP VIEW IF EXISTS city_cases;
 CREATE VIEW city_cases AS
@@ -1,5 +1,22 @@
-DROP VIEW IF EXISTS new_cases_per_state;
-CREATE VIEW new_cases_per_state AS
+/* Weeks with refreshed dates (`refresh_week`, see `00-setup.sql`) are recalculated */
+CREATE INDEX IF NOT EXISTS idx_caso_full_week ON caso_full (
+	place_type,
+	epidemiological_week
+);
+
+CREATE TABLE IF NOT EXISTS state_new_cases_per_week (
+	epidemiological_week INTEGER,
+	state TEXT,
+	new_confirmed INTEGER,
+	new_deaths INTEGER,
+	PRIMARY KEY (epidemiological_week, state)
+);
+
+BEGIN;
+DELETE FROM state_new_cases_per_week
+	WHERE
+		epidemiological_week IN (SELECT epidemiological_week FROM refresh_week);
+INSERT INTO state_new_cases_per_week
 	SELECT
 		epidemiological_week,
 		state,
@@ -8,9 +25,20 @@ CREATE VIEW new_cases_per_state AS
 	FROM caso_full
 	WHERE
 		place_type = 'state'
+		AND epidemiological_week IN (SELECT epidemiological_week FROM refresh_week)
 	GROUP BY
 		epidemiological_week,
 		state;
+COMMIT;
+
+DROP VIEW IF EXISTS new_cases_per_state;
+CREATE VIEW new_cases_per_state AS
+	SELECT
+		*
+	FROM state_new_cases_per_week
+	ORDER BY
+		epidemiological_week,
+		state;
 
 DROP VIEW IF EXISTS new_cases;
 CREATE VIEW new_cases AS
@@ -18,8 +46,6 @@ CREATE VIEW new_cases AS
 		epidemiological_week,
 		SUM(new_confirmed) AS new_confirmed,
 		SUM(new_deaths) AS new_deaths
-	FROM caso_full
-	WHERE
-		place_type = 'state'
+	FROM state_new_cases_per_week
 	GROUP BY
 		epidemiological_week;
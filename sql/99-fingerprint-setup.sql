@@ -0,0 +1,9 @@
+/* Runs after all the other setup files: the aggregates are up to date with
+   the source rows, so their fingerprints are saved (see `00-setup.sql`) */
+BEGIN;
+DELETE FROM materialized_fingerprint;
+INSERT INTO materialized_fingerprint
+	SELECT
+		*
+	FROM source_fingerprint;
+COMMIT;
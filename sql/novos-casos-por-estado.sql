@@ -1 +1,6 @@
-SELECT * FROM new_cases_per_state;
+SELECT
+	*
+FROM state_new_cases_per_week
+ORDER BY
+	epidemiological_week,
+	state;
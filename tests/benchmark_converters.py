@@ -0,0 +1,54 @@
+"""Benchmark `converters.extract_caso` with a large state
+
+`tests/data/AC.json` cases are replicated for every MG city, so the payload
+has the same size as MG's one (850+ cities, one column pair per day).
+
+Usage: python tests/benchmark_converters.py [--repeat 3]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).absolute().parent.parent))
+
+from covid19br import converters, demographics  # noqa
+
+DATA_PATH = Path(__file__).absolute().parent / "data"
+
+
+def get_scaled_cases(state="MG"):
+    with open(DATA_PATH / "AC.json") as fobj:
+        ac_cases = json.load(fobj)["cases"]
+    ac_total = ac_cases[0]
+    ac_cities = [caso for caso in ac_cases if caso["municipio"] not in ("TOTAL NO ESTADO", "Importados/Indefinidos")]
+
+    cases = [dict(ac_total)]
+    for index, city in enumerate(demographics.cities(2020)[state].keys()):
+        caso = dict(ac_cities[index % len(ac_cities)])
+        caso["municipio"] = city
+        cases.append(caso)
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--state", default="MG")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cases = get_scaled_cases(args.state)
+    columns = sum(len(caso) - 1 for caso in cases)
+    print(f"{args.state}: {len(cases)} rows, {columns} number columns")
+    for run in range(1, args.repeat + 1):
+        data = [dict(caso) for caso in cases]  # `extract_caso` changes the rows
+        start = time.perf_counter()
+        total = sum(1 for _ in converters.extract_caso(args.state, data))
+        elapsed = time.perf_counter() - start
+        print(f"Run {run}: {total} rows in {elapsed:.3f}s ({total / elapsed:,.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -40,3 +40,16 @@ def test_expected_caso():
         expected = json.load(fobj)
 
     assert expected == converted
+
+
+def test_caso_column_plan():
+    plan = converters.caso_column_plan(
+        [{"municipio": "Rio Branco", "confirmados_31_12": 1, "mortes_31_12": 0, "confirmados_01_01": 2}]
+    )
+
+    assert plan == {
+        "municipio": None,
+        "confirmados_31_12": ("2020-12-31", "confirmed"),
+        "mortes_31_12": ("2020-12-31", "deaths"),
+        "confirmados_01_01": ("2021-01-01", "confirmed"),
+    }
@@ -0,0 +1,109 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bot import rocketchat
+
+
+class FakeRocketChatHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server.connections.add(self.client_address)
+        if self.path == "/api/v1/login":
+            self.send_json({"status": "success", "data": {"userId": "bot", "authToken": "token", "me": {}}})
+        elif self.path == "/api/v1/chat.postMessage":
+            assert self.headers["X-Auth-Token"] == "token"
+            if server.rate_limited > 0:
+                server.rate_limited -= 1
+                self.send_json({"success": False}, status=429, headers={"Retry-After": server.retry_after})
+                return
+            data = json.loads(body)
+            server.messages.append((time.monotonic(), data["channel"], data["text"]))
+            self.send_json({"success": True})
+        else:
+            self.send_json({"success": False}, status=404)
+
+
+@pytest.fixture
+def fake_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeRocketChatHandler)
+    server.connections, server.messages, server.rate_limited, server.retry_after = set(), [], 0, "0"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_chat(server):
+    chat = rocketchat.RocketChat(f"http://127.0.0.1:{server.server_address[1]}/")
+    chat.login("bot", "password")
+    return chat
+
+
+def test_notifications_are_coalesced_per_channel(fake_server):
+    notifications = rocketchat.NotificationQueue(make_chat(fake_server), channel_interval=0)
+    notifications.add("#sp", "first alert")
+    notifications.add("#rj", "other alert")
+    notifications.add("#sp", "second alert")
+    assert fake_server.messages == []  # Nothing sent before flush/close
+    notifications.close()
+
+    messages = {channel: text for _, channel, text in fake_server.messages}
+    assert len(fake_server.messages) == 2
+    assert messages == {"#sp": "first alert\n\nsecond alert", "#rj": "other alert"}
+    assert len(fake_server.connections) == 1  # Login and messages on the same connection
+    assert notifications.errors == []
+
+
+def test_notifications_rate_limit_and_retry(fake_server):
+    fake_server.rate_limited = 1
+    notifications = rocketchat.NotificationQueue(make_chat(fake_server), channel_interval=0.2, max_length=20)
+    for index in range(3):
+        notifications.add("#sp", f"alert number {index}")
+    notifications.close()
+
+    assert [text for _, _, text in fake_server.messages] == ["alert number 0", "alert number 1", "alert number 2"]
+    times = [sent_at for sent_at, _, _ in fake_server.messages]
+    assert all(later - earlier >= 0.19 for earlier, later in zip(times, times[1:]))
+    assert notifications.errors == []
+
+
+def test_long_messages_are_split(fake_server):
+    notifications = rocketchat.NotificationQueue(make_chat(fake_server), channel_interval=0, max_length=10)
+    notifications.add("#sp", "short")
+    notifications.add("#sp", "x" * 25)
+    notifications.close()
+
+    assert [text for _, _, text in fake_server.messages] == ["short", "x" * 10, "x" * 10, "x" * 5]
+    assert notifications.errors == []
+
+
+def test_retry_after_http_date(fake_server):
+    fake_server.rate_limited = 1
+    fake_server.retry_after = "Wed, 21 Oct 2015 07:28:00 GMT"  # In the past: retry now
+    notifications = rocketchat.NotificationQueue(make_chat(fake_server), channel_interval=0)
+    notifications.add("#sp", "alert")
+    notifications.close()
+
+    assert [text for _, _, text in fake_server.messages] == ["alert"]
+    assert notifications.errors == []
@@ -0,0 +1,56 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("scrapy")
+
+from web import spiders  # noqa: E402
+from web.spiders.base import BaseCovid19Spider  # noqa: E402
+
+
+class FakeBulletinHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = b"confirmed=10;deaths=2"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FakeStateSpider(BaseCovid19Spider):
+    name = "XX"
+    start_urls = []
+
+    def parse(self, response):
+        data = dict(item.split("=") for item in response.text.split(";"))
+        self.add_report(date="2020-05-01", url=response.url)
+        self.add_state_case(confirmed=int(data["confirmed"]), deaths=int(data["deaths"]))
+
+
+@pytest.fixture
+def spider_pool(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBulletinHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    # Workers are forked after the spider is registered
+    monkeypatch.setattr(FakeStateSpider, "start_urls", [f"http://127.0.0.1:{server.server_port}/boletim"])
+    monkeypatch.setitem(spiders.STATE_SPIDERS, FakeStateSpider.name, FakeStateSpider)
+    pool = spiders.SpiderPool(processes=1, max_queue_size=2, timeout=30)
+    yield pool
+    pool.close()
+    server.shutdown()
+    server.server_close()
+
+
+def test_spider_pool_runs_crawls_in_the_same_worker(spider_pool):
+    for _ in range(2):  # The second crawl reuses the worker's reactor
+        status, result = spider_pool.run("XX")
+        assert status == "ok", result
+        report_fobj, case_fobj = result
+        assert report_fobj.read().splitlines()[0] == "date,url"
+        assert case_fobj.read().splitlines() == ["municipio,confirmados,mortes", "TOTAL NO ESTADO,10,2"]
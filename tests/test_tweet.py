@@ -0,0 +1,66 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+
+import tweet
+
+STATE_VALUES = [
+    ["state", "confirmed", "deaths", "data_boletim", "MS"],
+    ["AC", "41689", "796", "2021-01-01", ""],
+    ["AL", "105091", "2497", "2021-01-01"],
+]
+DIFF_STATES_VALUES = [
+    [
+        "2021-01-01", "AC", "2021-01-01", "41689", "796", "", "",
+        "AC", "2020-12-31", "2020-12-31", "41620", "795", "", "",
+        "69", "0.17%", "1", "0.13%", "", "", "1",
+    ],
+]
+
+
+class FakeSpreadsheet:
+    def __init__(self):
+        self.calls = []
+
+    def values_batch_get(self, ranges, params=None):
+        self.calls.append(ranges)
+        values = {"Sheet1": STATE_VALUES, "diff_states!B4:V30": DIFF_STATES_VALUES}
+        return {"valueRanges": [{"range": name, "values": values[name]} for name in ranges]}
+
+
+class FakeClient:
+    def __init__(self):
+        self.spreadsheet = FakeSpreadsheet()
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+
+def test_spreadsheet_snapshot_single_api_call(tmp_path):
+    client = FakeClient()
+    snapshot_filename = tmp_path / "data" / "snapshot.json"  # Directory is created
+    spreadsheet = tweet.COVID19Spreadsheet(None, "id", snapshot_filename=snapshot_filename, client=client)
+
+    state_data = spreadsheet.state_data
+    diff_states = spreadsheet.diff_states
+    spreadsheet.state_data, spreadsheet.diff_states
+
+    assert len(client.spreadsheet.calls) == 1
+    assert state_data[0] == {"state": "AC", "confirmed": 41689, "deaths": 796, "data_boletim": "2021-01-01", "MS": ""}
+    assert state_data[1]["MS"] == ""
+    assert diff_states[0]["today_date"] == datetime.date(2021, 1, 1)
+    assert diff_states[0]["novos_casos"] == 69
+    assert diff_states[0]["novos_casos_percent"] == Decimal("0.0017")
+    assert diff_states[0]["today_vaccination"] is None
+
+    # Bulletin can be generated again from the saved snapshot, without the API
+    offline = tweet.COVID19Spreadsheet.from_snapshot(snapshot_filename)
+    assert offline.state_data == state_data
+    assert offline.diff_states == diff_states
+    assert len(client.spreadsheet.calls) == 1
+
+
+def test_offline_spreadsheet_without_snapshot(tmp_path):
+    with pytest.raises(FileNotFoundError, match="snapshot not found"):
+        tweet.COVID19Spreadsheet.from_snapshot(tmp_path / "missing.json")
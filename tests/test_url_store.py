@@ -0,0 +1,48 @@
+import datetime
+import io
+
+from bot.url_store import URLStore
+
+CHECK_DATETIME = datetime.datetime(2020, 5, 1, 10, tzinfo=datetime.timezone(datetime.timedelta(hours=-3)))
+
+
+def test_upsert_and_get():
+    store = URLStore(":memory:")
+    assert store.get("https://example.com/")["text"] is None
+    store.upsert(
+        {
+            "url": "https://example.com/",
+            "last_check_datetime": CHECK_DATETIME,
+            "text": "text " * 1000,
+            "simhash": 2 ** 64 - 1,
+        }
+    )
+    store.upsert({**store.get("https://example.com/"), "text": "new text"})
+    store.update_check_datetime("https://example.com/", CHECK_DATETIME + datetime.timedelta(hours=1))
+
+    url_info = store.get("https://example.com/")
+    assert len(store) == 1
+    assert url_info["text"] == "new text"
+    assert url_info["simhash"] == 2 ** 64 - 1
+    assert url_info["last_check_datetime"] == CHECK_DATETIME + datetime.timedelta(hours=1)
+
+
+def test_export_and_import_csv():
+    store = URLStore(":memory:")
+    store.upsert({"url": "https://example.com/", "last_check_datetime": CHECK_DATETIME, "text": "a", "min_distance": 5})
+    store.upsert({"url": "https://example.org/", "last_check_datetime": None, "text": "ERROR"})
+    fobj = io.StringIO()
+    store.export_csv(fobj)
+
+    new_store = URLStore(":memory:")
+    new_store.import_csv(io.StringIO(fobj.getvalue()))
+    assert list(new_store) == list(store)
+
+
+def test_retain_urls():
+    store = URLStore(":memory:")
+    for url in ("https://example.com/", "https://example.org/", "https://example.net/"):
+        store.upsert({"url": url, "text": "a"})
+
+    assert store.retain(["https://example.org/", "https://example.net/"]) == 1
+    assert [url_info["url"] for url_info in store] == ["https://example.net/", "https://example.org/"]
@@ -1,73 +1,192 @@
 import datetime
-import hashlib
 import json
 import os
 from decimal import Decimal
+from pathlib import Path
 from string import Template
 
 import gspread
 import rows
+from cached_property import cached_property
 from oauth2client.service_account import ServiceAccountCredentials
-from rows.utils import open_compressed
-from tqdm import tqdm
+
+from covid19br.fingerprint import file_metadata, load_metadata
+
+
+DIFF_STATES_HEADER = (
+    "today_date",
+    "today_state",
+    "today_data_dados",
+    "today_confirmed",
+    "today_deaths",
+    "today_vaccination",
+    "empty_1",
+    "yesterday_state",
+    "yesterday_date",
+    "yesterday_data_dados",
+    "yesterday_confirmed",
+    "yesterday_deaths",
+    "yesterday_vaccination",
+    "empty_2",
+    "novos_casos",
+    "novos_casos_percent",
+    "novas_mortes",
+    "novas_mortes_percent",
+    "novos_vacinados",
+    "novos_vacinados_percent",
+    "diff_dias",
+)
+
+
+def parse_int(value):
+    return int(value) if value else None
+
+
+def parse_str(value):
+    return value
+
+
+def numericise(value):
+    """Convert like `gspread`'s `get_all_records` does"""
+    if isinstance(value, str) and "_" in value:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def diff_states_parser(key):
+    if "_percent" in key:
+        return rows.fields.PercentField.deserialize
+    elif key.endswith("_date") or "_data_" in key:
+        return rows.fields.DateField.deserialize
+    elif (
+        "_confirmed" in key
+        or "_deaths" in key
+        or "vaccination" in key
+        or "novos_" in key
+        or "novas_" in key
+        or key == "diff_dias"
+    ):
+        return parse_int
+    return parse_str
+
+
+DIFF_STATES_PLAN = tuple(diff_states_parser(key) for key in DIFF_STATES_HEADER)
+
+
+class SpreadsheetSnapshot:
+    """Values of all the ranges used from the spreadsheet, read at once
+
+    Raw values are kept (and saved as JSON), so the same bulletin can be
+    generated again offline from a saved snapshot.
+    """
+
+    state_range = "Sheet1"
+    diff_states_range = "diff_states!B4:V30"
+    ranges = (state_range, diff_states_range)
+
+    def __init__(self, values, created_at):
+        self.values = values
+        self.created_at = created_at
+
+    @classmethod
+    def fetch(cls, spreadsheet):
+        response = spreadsheet.values_batch_get(list(cls.ranges))
+        values = {name: value_range.get("values", []) for name, value_range in zip(cls.ranges, response["valueRanges"])}
+        return cls(values, created_at=datetime.datetime.now(datetime.timezone.utc))
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as fobj:
+            data = json.load(fobj)
+        return cls(data["values"], created_at=datetime.datetime.fromisoformat(data["created_at"]))
+
+    def save(self, filename):
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        with open(filename, mode="w") as fobj:
+            json.dump({"created_at": self.created_at.isoformat(), "values": self.values}, fobj)
+
+    def age(self):
+        return (datetime.datetime.now(datetime.timezone.utc) - self.created_at).total_seconds()
+
+    @cached_property
+    def state_data(self):
+        values = self.values[self.state_range]
+        if not values:
+            return []
+        header, data = values[0], values[1:]
+        return [
+            dict(zip(header, [numericise(value) for value in row] + [""] * (len(header) - len(row))))
+            for row in data
+        ]
+
+    @cached_property
+    def diff_states(self):
+        return [
+            {key: parse(value) for key, parse, value in zip(DIFF_STATES_HEADER, DIFF_STATES_PLAN, row)}
+            for row in self.values[self.diff_states_range]
+        ]
 
 
 class COVID19Spreadsheet:
-    def __init__(self, credentials_filename, spreadsheet_id):
-        with open(credentials_filename) as fobj:
+    """Bulletin spreadsheet, read from a (cached) `SpreadsheetSnapshot`
+
+    The snapshot is fetched only once per instance (with one API call) and
+    saved to `snapshot_filename`, if given. A saved snapshot newer than
+    `max_age` seconds is used instead of calling the API.
+    """
+
+    def __init__(self, credentials_filename, spreadsheet_id, snapshot_filename=None, max_age=0, client=None):
+        self.credentials_filename = credentials_filename
+        self.spreadsheet_id = spreadsheet_id
+        self.snapshot_filename = snapshot_filename
+        self.max_age = max_age
+        self._client = client
+
+    @classmethod
+    def from_snapshot(cls, snapshot_filename):
+        """Use a saved snapshot, without accessing the API"""
+        if not Path(snapshot_filename).exists():
+            raise FileNotFoundError(f"Spreadsheet snapshot not found: {snapshot_filename} (run once without --offline)")
+        return cls(None, None, snapshot_filename=snapshot_filename, max_age=float("inf"))
+
+    @cached_property
+    def client(self):
+        if self._client is not None:
+            return self._client
+        with open(self.credentials_filename) as fobj:
             credentials = json.load(fobj)
-        self.account = ServiceAccountCredentials.from_json_keyfile_dict(credentials)
-        self.client = gspread.authorize(self.account)
-        self.spreadsheet = self.client.open_by_key(spreadsheet_id)
+        account = ServiceAccountCredentials.from_json_keyfile_dict(credentials)
+        return gspread.authorize(account)
+
+    @cached_property
+    def spreadsheet(self):
+        return self.client.open_by_key(self.spreadsheet_id)
+
+    @cached_property
+    def snapshot(self):
+        if self.snapshot_filename is not None and Path(self.snapshot_filename).exists():
+            snapshot = SpreadsheetSnapshot.load(self.snapshot_filename)
+            if snapshot.age() <= self.max_age:
+                return snapshot
+
+        snapshot = SpreadsheetSnapshot.fetch(self.spreadsheet)
+        if self.snapshot_filename is not None:
+            snapshot.save(self.snapshot_filename)
+        return snapshot
 
     @property
     def state_data(self):
-        return self.spreadsheet.worksheet("Sheet1").get_all_records()
+        return self.snapshot.state_data
 
     @property
     def diff_states(self):
-        header = [
-            "today_date",
-            "today_state",
-            "today_data_dados",
-            "today_confirmed",
-            "today_deaths",
-            "today_vaccination",
-            "empty_1",
-            "yesterday_state",
-            "yesterday_date",
-            "yesterday_data_dados",
-            "yesterday_confirmed",
-            "yesterday_deaths",
-            "yesterday_vaccination",
-            "empty_2",
-            "novos_casos",
-            "novos_casos_percent",
-            "novas_mortes",
-            "novas_mortes_percent",
-            "novos_vacinados",
-            "novos_vacinados_percent",
-            "diff_dias",
-        ]
-        result = []
-        for row in self.spreadsheet.worksheet("diff_states").get("B4:V30"):
-            row = dict(zip(header, row))
-            for key, value in row.items():
-                if "_percent" in key:
-                    row[key] = rows.fields.PercentField.deserialize(value)
-                elif key.endswith("_date") or "_data_" in key:
-                    row[key] = rows.fields.DateField.deserialize(value)
-                elif (
-                    "_confirmed" in key
-                    or "_deaths" in key
-                    or "vaccination" in key
-                    or "novos_" in key
-                    or "novas_" in key
-                    or key == "diff_dias"
-                ):
-                    row[key] = int(value) if value else None
-            result.append(row)
-        return result
+        return list(self.snapshot.diff_states)  # Callers may sort it
 
 
 def format_number_br(n):
@@ -122,49 +241,25 @@ def abbreviate_number(n, divider=1_000, suffix=None):
         return f"{n:.1f}{multiplier}" + suffix
 
 
-def file_metadata(filename, chunk_size=8 * 1024 * 1024):
-    hasher = hashlib.sha1()
-
-    with open(filename, mode="rb") as fobj, tqdm(unit_scale=True, unit="B") as progress:
-        finished = False
-        while not finished:
-            data = fobj.read(chunk_size)
-            hasher.update(data)
-            chunk_length = len(data)
-            finished = chunk_length == 0
-            progress.update(chunk_length)
-        total_bytes = progress.n
-
-    new_lines = 0
-    with open_compressed(filename, mode="rb") as fobj, tqdm(unit_scale=True, unit="B") as progress:
-        finished = False
-        finish_with_new_line = False
-        while not finished:
-            data = fobj.read(chunk_size)
-            new_lines += data.count(b"\n")
-            chunk_length = len(data)
-            finished = chunk_length == 0
-            if not finished:
-                finish_with_new_line = data[-1] == b"\n"
-            progress.update(chunk_length)
-        uncompressed_bytes = progress.n
-        if not finish_with_new_line:
-            new_lines += 1
-
-    return hasher.hexdigest(), new_lines, total_bytes, uncompressed_bytes
-
-
 def main():
     import argparse
 
     parser = argparse.ArgumentParser()
+    parser.add_argument("--snapshot-filename", default="data/bulletin-spreadsheet.json")
+    parser.add_argument("--max-age", type=int, default=0, help="Use saved snapshot newer than this (seconds)")
+    parser.add_argument("--offline", action="store_true", help="Use saved snapshot, whatever its age")
     parser.add_argument("tweet_type", choices=["boletim", "vacinacao"])
     args = parser.parse_args()
 
     if args.tweet_type == "boletim":
-        credentials_filename = "credentials/credentials-brasil-io-covid19.json"
-        spreadsheet_id = os.environ["BULLETIN_SPREADSHEET_ID"]
-        spreadsheet = COVID19Spreadsheet(credentials_filename, spreadsheet_id)
+        if args.offline:
+            spreadsheet = COVID19Spreadsheet.from_snapshot(args.snapshot_filename)
+        else:
+            credentials_filename = "credentials/credentials-brasil-io-covid19.json"
+            spreadsheet_id = os.environ["BULLETIN_SPREADSHEET_ID"]
+            spreadsheet = COVID19Spreadsheet(
+                credentials_filename, spreadsheet_id, snapshot_filename=args.snapshot_filename, max_age=args.max_age,
+            )
 
         start_date = datetime.date(2020, 6, 6)
         today = datetime.datetime.now().date()
@@ -233,7 +328,9 @@ def main():
 
     elif args.tweet_type == "vacinacao":
         filename = "data/output/microdados_vacinacao.csv.gz"
-        sha1, lines, total_bytes, uncompressed_bytes = file_metadata(filename)
+        # Metadata is saved by `microdados_vacinacao.py` while writing the file
+        metadata = load_metadata(filename) or file_metadata(filename)
+        sha1, lines, total_bytes, uncompressed_bytes = metadata
         file_size = abbreviate_number(total_bytes, suffix="B")
         url = "https://data.brasil.io/dataset/covid19/microdados_vacinacao.csv.gz"
         print(
@@ -1,3 +1,6 @@
 #!/bin/bash
 
+# Each gunicorn worker has its own spider pool (SPIDER_WORKERS processes and
+# SPIDER_QUEUE_SIZE pending jobs): concurrent crawls are only coalesced per
+# worker (the result cache on disk is shared)
 gunicorn web.app:app --bind=0.0.0.0:5000 --workers=4 --log-file -
@@ -1,10 +1,20 @@
-import csv
+import datetime
+from functools import lru_cache
 
-from flask import Flask, make_response
+from flask import Flask, jsonify, make_response, request, url_for
 
-from web.spiders import STATE_SPIDERS, run_state_spider
+from web.cache import ResultCache
+from web.spiders import STATE_SPIDERS, SpiderQueueFull, get_spider_pool
 
 app = Flask(__name__)
+result_cache = ResultCache()
+
+
+@lru_cache(maxsize=1)
+def get_pool():
+    pool = get_spider_pool()
+    pool.add_listener(result_cache.store)
+    return pool
 
 
 @app.route("/")
@@ -25,23 +35,49 @@ def index():
     """
 
 
+def cached_csv_response(state):
+    metadata = result_cache.metadata(state)
+    response = make_response(result_cache.read_csv(state))
+    response.headers["Content-Disposition"] = f"attachment; filename=caso-{state}-{metadata['date']}.csv"
+    response.headers["Content-type"] = "text/csv"
+    response.set_etag(metadata["etag"])
+    response.last_modified = datetime.datetime.fromtimestamp(metadata["updated_at"], tz=datetime.timezone.utc)
+    return response.make_conditional(request)
+
+
+def job_status_response(state, status_code):
+    response = jsonify(job_status(state))
+    response.status_code = status_code
+    response.headers["Location"] = url_for("get_state_job", state=state)
+    return response
+
+
 def get_spider_response(state):
-    status, response = run_state_spider(state)
-    if status == "error":
-        return make_response(f"Error while running spider: {response}", 500)
+    if not result_cache.is_fresh(state):
+        # Mark as running before submitting, so a quick result is not overwritten
+        previous_metadata = result_cache.metadata(state)
+        result_cache.mark_running(state)
+        try:
+            get_pool().run(state)  # Result is saved to the cache by the listener
+        except SpiderQueueFull:
+            result_cache.update_metadata(state, **previous_metadata)
+            return job_status_response(state, 503)
+        metadata = result_cache.metadata(state)
+        if metadata["status"] == "error":
+            return make_response(f"Error while running spider: {metadata['error']}", 500)
+        elif metadata["status"] != "ok" or not result_cache.is_fresh(state):
+            # Timeout while waiting: the spider keeps running in background
+            return job_status_response(state, 202)
 
-    report_fobj, case_fobj = response
-    reports = list(csv.DictReader(report_fobj))
-    if not reports:
-        return make_response(f"Could not find any report (see spider logs)", 500)
+    return cached_csv_response(state)
 
-    date = reports[0]["date"]
-    # TODO: do something with reports
 
-    response = make_response(case_fobj.getvalue())
-    response.headers["Content-Disposition"] = f"attachment; filename=caso-{state}-{date}.csv"
-    response.headers["Content-type"] = "text/csv"
-    return response
+def job_status(state):
+    metadata = result_cache.metadata(state)
+    metadata["state"] = state
+    metadata["fresh"] = result_cache.is_fresh(state)
+    metadata["csv_url"] = url_for("get_state_csv", state=state) if metadata["fresh"] else None
+    return metadata
 
 
 @app.route("/<state>")
@@ -53,5 +89,40 @@ def get_state_csv(state):
     return get_spider_response(state)
 
 
+@app.route("/<state>/jobs", methods=["GET"])
+def get_state_job(state):
+    state = state.upper().strip()
+    if state not in STATE_SPIDERS:
+        return "State not found", 404
+
+    return jsonify(job_status(state))
+
+
+@app.route("/<state>/jobs", methods=["POST"])
+def create_state_job(state):
+    """Start a spider run in background (if the cached result is not fresh)
+
+    Poll `GET /<state>/jobs` until `status` is "ok" or "error". Use
+    `?force=1` to run the spider even if the cached result is fresh.
+    """
+    state = state.upper().strip()
+    if state not in STATE_SPIDERS:
+        return "State not found", 404
+
+    if result_cache.is_fresh(state) and not request.args.get("force"):
+        return jsonify(job_status(state)), 200
+    pool = get_pool()
+    # Mark as running before submitting, so a quick result is not overwritten
+    previous_metadata = result_cache.metadata(state)
+    result_cache.mark_running(state)
+    try:
+        pool.submit(state)
+    except SpiderQueueFull as exception:
+        result_cache.update_metadata(state, **previous_metadata)
+        return make_response(f"Server busy, try again later: {exception}", 503)
+
+    return job_status_response(state, 202)
+
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0")
@@ -0,0 +1,118 @@
+import csv
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+BASE_PATH = Path(__file__).parent.parent
+RESULT_CACHE_PATH = Path(os.environ.get("RESULT_CACHE_PATH", BASE_PATH / "data" / "web-cache"))
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", 600))
+
+
+class ResultCache:
+    """Spider results and job status per state, stored on disk
+
+    Files are shared by all web server processes: `caso-<state>.csv` has the
+    last successful result and `<state>.json` its metadata (job status,
+    last update, report date and ETag). A result is fresh for `ttl` seconds.
+    Writers of the same state are serialized by a lock file (`.<state>.lock`).
+    """
+
+    def __init__(self, path=RESULT_CACHE_PATH, ttl=RESULT_CACHE_TTL):
+        self.path = Path(path)
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+        self.ttl = ttl
+
+    def csv_filename(self, state):
+        return self.path / f"caso-{state}.csv"
+
+    def metadata_filename(self, state):
+        return self.path / f"{state}.json"
+
+    def lock_filename(self, state):
+        return self.path / f".{state}.lock"
+
+    @contextmanager
+    def lock(self, state):
+        with open(self.lock_filename(state), mode="a") as fobj:
+            fcntl.flock(fobj, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fobj, fcntl.LOCK_UN)
+
+    def write_file(self, filename, content):
+        """Write to a unique temporary file first so readers never see partial data"""
+        with tempfile.NamedTemporaryFile(
+            mode="w", dir=self.path, prefix=f".{filename.name}.", suffix=".tmp", delete=False
+        ) as fobj:
+            fobj.write(content)
+        try:
+            os.replace(fobj.name, filename)
+        except OSError:
+            os.unlink(fobj.name)
+            raise
+
+    def metadata(self, state):
+        filename = self.metadata_filename(state)
+        if not filename.exists():
+            return {"status": "not-started"}
+        with open(filename) as fobj:
+            return json.load(fobj)
+
+    def update_metadata(self, state, **data):
+        with self.lock(state):
+            return self._update_metadata(state, **data)
+
+    def _update_metadata(self, state, **data):
+        metadata = self.metadata(state)
+        metadata.update(data)
+        self.write_file(self.metadata_filename(state), json.dumps(metadata))
+        return metadata
+
+    def mark_running(self, state):
+        return self.update_metadata(state, status="running", started_at=time.time(), error=None)
+
+    def is_fresh(self, state):
+        updated_at = self.metadata(state).get("updated_at")
+        return updated_at is not None and time.time() - updated_at < self.ttl and self.csv_filename(state).exists()
+
+    def read_csv(self, state):
+        with open(self.csv_filename(state)) as fobj:
+            return fobj.read()
+
+    def store(self, state, result):
+        """Save a spider result (as returned by `run_state_spider`)"""
+        status, response = result
+        if status == "error":
+            return self.update_metadata(state, status="error", error=response, finished_at=time.time())
+
+        report_fobj, case_fobj = response
+        reports = list(csv.DictReader(report_fobj))
+        report_fobj.seek(0)
+        if not reports:
+            return self.update_metadata(
+                state,
+                status="error",
+                error="Could not find any report (see spider logs)",
+                finished_at=time.time(),
+            )
+
+        content = case_fobj.getvalue()
+        with self.lock(state):  # The ETag must match the CSV
+            self.write_file(self.csv_filename(state), content)
+            now = time.time()
+            return self._update_metadata(
+                state,
+                status="ok",
+                error=None,
+                finished_at=now,
+                updated_at=now,
+                date=reports[0]["date"],
+                etag=hashlib.sha1(content.encode("utf-8")).hexdigest(),
+            )
@@ -1,7 +1,12 @@
 import io
+import logging
 import multiprocessing
+import os
+import threading
+import traceback
+from functools import lru_cache
 
-from scrapy.crawler import CrawlerProcess
+from scrapy.crawler import CrawlerProcess, CrawlerRunner
 
 from .spider_ce import Covid19CESpider
 from .spider_es import Covid19ESSpider
@@ -20,17 +25,31 @@ SPIDERS = [
 ]
 STATE_SPIDERS = {SpiderClass.name: SpiderClass for SpiderClass in SPIDERS}
 # TODO: do autodiscovery from base class' subclasses
+# Pool settings are per web server process (each gunicorn worker has its own
+# pool, so `web.sh` may run up to `--workers` x `SPIDER_WORKERS` crawls)
+SPIDER_WORKERS = int(os.environ.get("SPIDER_WORKERS", 2))
+# Jobs are coalesced per state, so there is at most one pending job per state
+SPIDER_QUEUE_SIZE = int(os.environ.get("SPIDER_QUEUE_SIZE", len(STATE_SPIDERS)))
+SPIDER_TIMEOUT = int(os.environ.get("SPIDER_TIMEOUT", 120))
+# Must be installed before anything imports `twisted.internet.reactor` and be
+# the same requested by the crawler settings (Scrapy checks it); async
+# callbacks await executor futures on its asyncio loop
+WORKER_REACTOR = "twisted.internet.asyncioreactor.AsyncioSelectorReactor"
+WORKER_SETTINGS = {"TWISTED_REACTOR": WORKER_REACTOR}
+logger = logging.getLogger(__name__)
+
+
+class SpiderQueueFull(RuntimeError):
+    pass
 
 
 def execute_spider_worker(SpiderClass):
     report_fobj, case_fobj = io.StringIO(), io.StringIO()
     try:
-        process = CrawlerProcess(settings={})
+        process = CrawlerProcess(settings=WORKER_SETTINGS)
         process.crawl(SpiderClass, report_fobj=report_fobj, case_fobj=case_fobj)
         process.start()
     except Exception:
-        import traceback
-
         return "error", traceback.format_exc()
     else:
         report_fobj.seek(0)
@@ -38,14 +57,135 @@ def execute_spider_worker(SpiderClass):
         return "ok", (report_fobj, case_fobj)
 
 
+def start_worker_reactor():
+    """Start the Twisted reactor in a background thread (pool initializer)
+
+    `CrawlerProcess` cannot be restarted, so long-lived workers keep one
+    reactor running and start each crawl with a `CrawlerRunner`.
+    """
+    from scrapy.utils.reactor import install_reactor
+
+    install_reactor(WORKER_REACTOR)
+    from twisted.internet import reactor
+
+    thread = threading.Thread(target=reactor.run, kwargs={"installSignalHandlers": False}, daemon=True)
+    thread.start()
+
+
+def crawl_in_worker(state, timeout):
+    from twisted.internet import reactor
+    from twisted.internet.threads import blockingCallFromThread
+
+    SpiderClass = STATE_SPIDERS[state]
+    report_fobj, case_fobj = io.StringIO(), io.StringIO()
+    crawlers = []
+
+    def crawl():
+        runner = CrawlerRunner(settings=WORKER_SETTINGS)
+        crawler = runner.create_crawler(SpiderClass)
+        crawlers.append(crawler)
+        deferred = runner.crawl(crawler, report_fobj=report_fobj, case_fobj=case_fobj)
+        stop_call = reactor.callLater(timeout, crawler.stop)
+
+        def cancel_stop(result):
+            if stop_call.active():
+                stop_call.cancel()
+            return result
+
+        return deferred.addBoth(cancel_stop)
+
+    try:
+        blockingCallFromThread(reactor, crawl)
+    except Exception:
+        return "error", traceback.format_exc()
+
+    finish_reason = crawlers[0].stats.get_value("finish_reason")
+    if finish_reason != "finished":
+        return "error", f"Spider for {state} did not finish (reason: {finish_reason}, timeout: {timeout}s)"
+    report_fobj.seek(0)
+    case_fobj.seek(0)
+    return "ok", (report_fobj, case_fobj)
+
+
+class SpiderPool:
+    """Pool of long-lived worker processes running spiders on demand
+
+    Each worker keeps its reactor (and Scrapy imports) alive between crawls.
+    At most `max_queue_size` different states can be pending at the same
+    time, and concurrent requests for the same state share the same crawl.
+    Listeners (`add_listener`) are called with `(state, result)` once per
+    crawl, before the result is delivered to the callers.
+
+    Crawls are coalesced only inside the process which owns the pool: with
+    many web server processes, each one has its own pool and queue.
+    """
+
+    def __init__(self, processes=SPIDER_WORKERS, max_queue_size=SPIDER_QUEUE_SIZE, timeout=SPIDER_TIMEOUT):
+        self.pool = multiprocessing.Pool(processes, initializer=start_worker_reactor)
+        self.processes = processes
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.listeners = []
+
+    def add_listener(self, function):
+        self.listeners.append(function)
+
+    def submit(self, state):
+        with self.lock:
+            job = self.jobs.get(state)
+            if job is not None:  # Coalesce with the crawl already running
+                return job
+            if len(self.jobs) >= self.max_queue_size:
+                raise SpiderQueueFull(f"Too many pending spider jobs ({len(self.jobs)})")
+
+            def finished(result):
+                try:
+                    for listener in self.listeners:
+                        try:
+                            listener(state, result)
+                        except Exception:
+                            logger.exception(f"Error in listener {listener!r} for spider {state}")
+                finally:
+                    with self.lock:
+                        self.jobs.pop(state, None)
+
+            def failed(exception):
+                finished(("error", repr(exception)))
+
+            job = self.pool.apply_async(
+                crawl_in_worker, (state, self.timeout), callback=finished, error_callback=failed,
+            )
+            self.jobs[state] = job
+            return job
+
+    def run(self, state):
+        job = self.submit(state)
+        # Jobs wait in the queue for free workers, which stop each spider
+        # after `timeout` seconds (plus some time for the spider to close).
+        waiting_rounds = 1 + max(len(self.jobs) - 1, 0) // self.processes
+        try:
+            return job.get(timeout=waiting_rounds * (self.timeout + 30))
+        except multiprocessing.TimeoutError:
+            return "error", f"Timeout while waiting for spider {state}"
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+@lru_cache(maxsize=1)
+def get_spider_pool():
+    return SpiderPool()
+
+
 def run_state_spider(state, subprocess=True):
     state = str(state or "").upper().strip()
     if state not in STATE_SPIDERS:
         raise ValueError(f"Spider for state {repr(state)} not found.")
 
-    SpiderClass = STATE_SPIDERS[state]
     if subprocess:
-        with multiprocessing.Pool(1) as pool:
-            return pool.map(execute_spider_worker, [SpiderClass])[0]
+        return get_spider_pool().run(state)
     else:
-        return execute_spider_worker(SpiderClass)
+        return execute_spider_worker(STATE_SPIDERS[state])
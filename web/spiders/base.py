@@ -1,23 +1,36 @@
 import csv
 from functools import lru_cache
-from pathlib import Path
 
 import rows
 import scrapy
-from cached_property import cached_property
 
-BASE_PATH = Path(__file__).parent.parent.parent
-POPULATION_PATH = BASE_PATH / "data" / "populacao-por-municipio-2020.csv"
+from covid19br import demographics
 
+UNDEFINED_CITY = "Importados/Indefinidos"
 
-def normalize_city_name(city):
-    city = rows.fields.slug(city)
-    for word in ("da", "das", "de", "do", "dos"):
-        city = city.replace(f"_{word}_", "_")
-    return city
+
+@lru_cache(maxsize=54)
+def state_city_index(state, city_id_digits=7, undefined_city_id=None):
+    """Return `(city_id_from_name, city_name_from_id)` for a state
+
+    Names are normalized (`demographics.normalize_city_name`) and city IDs are
+    the first `city_id_digits` of IBGE code (some sources omit the check
+    digit). Built once per process and shared by all spider instances.
+    """
+    city_id_from_name, city_name_from_id = {}, {}
+    for normalized_name, city in demographics.city_index(state).items():
+        city_id = int(str(city.city_ibge_code)[:city_id_digits])
+        city_id_from_name[normalized_name] = city_id
+        city_name_from_id[city_id] = city.city
+    city_id_from_name[demographics.normalize_city_name(UNDEFINED_CITY)] = undefined_city_id
+    city_name_from_id[undefined_city_id] = UNDEFINED_CITY
+    return city_id_from_name, city_name_from_id
 
 
 class BaseCovid19Spider(scrapy.Spider):
+    city_id_digits = 7
+    undefined_city_id = None
+
     def __init__(self, report_fobj, case_fobj, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.case_fobj = case_fobj
@@ -40,45 +53,23 @@ class BaseCovid19Spider(scrapy.Spider):
     def add_state_case(self, confirmed, deaths):
         self.case_data.append({"municipio": "TOTAL NO ESTADO", "confirmados": confirmed, "mortes": deaths})
 
-    @cached_property
-    def brazilian_population(self):
-        return rows.import_from_csv(POPULATION_PATH)
-
-    @lru_cache(maxsize=900)
-    def state_population(self, state):
-        return [row for row in self.brazilian_population if row.state == state]
+    def city_index(self):
+        return state_city_index(self.name, self.city_id_digits, self.undefined_city_id)
 
-    @cached_property
-    def population(self):
-        return self.state_population(self.name)
-
-    @cached_property
-    def city_id_from_name(self):
-        data = {row.city: int(row.city_ibge_code) for row in self.population}
-        data["Importados/Indefinidos"] = None
-        return data
-
-    @lru_cache(maxsize=900)
     def get_city_id_from_name(self, name):
-        normalized_cities = {normalize_city_name(key): value for key, value in self.city_id_from_name.items()}
-        return normalized_cities[normalize_city_name(name)]
-
-    @cached_property
-    def city_name_from_id(self):
-        data = {int(row.city_ibge_code): row.city for row in self.population}
-        data[None] = "Importados/Indefinidos"
-        return data
+        city_id_from_name, _ = self.city_index()
+        return city_id_from_name[demographics.normalize_city_name(name)]
 
-    @lru_cache(maxsize=900)
     def get_city_name_from_id(self, city_id):
-        return self.city_name_from_id[city_id]
+        _, city_name_from_id = self.city_index()
+        return city_name_from_id[city_id]
 
     @property
     def normalized_case_data(self):
         def order_function(row):
             if row["municipio"] == "TOTAL NO ESTADO":
                 return "0"
-            elif row["municipio"] == "Importados/Indefinidos":
+            elif row["municipio"] == UNDEFINED_CITY:
                 return "1"
             else:
                 return rows.fields.slug(row["municipio"])
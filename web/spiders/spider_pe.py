@@ -4,7 +4,6 @@ import json
 from itertools import groupby
 
 import rows
-from cached_property import cached_property
 
 from .base import BaseCovid19Spider
 
@@ -13,17 +12,8 @@ class Covid19PESpider(BaseCovid19Spider):
     name = "PE"
     start_urls = ["https://dados.seplag.pe.gov.br/apps/corona_dados.html"]
 
-    @cached_property
-    def city_name_from_id(self):
-        data = {int(str(row.city_ibge_code)[:-1]): row.city for row in self.population}
-        data[0] = "Importados/Indefinidos"
-        return data
-
-    @cached_property
-    def city_id_from_name(self):
-        data = {row.city: int(str(row.city_ibge_code)[:-1]) for row in self.population}
-        data["Importados/Indefinidos"] = 0
-        return data
+    city_id_digits = 6  # IBGE codes without the check digit
+    undefined_city_id = 0
 
     def parse(self, response):
         page_jsons = response.xpath("//script[@type='application/json' and @data-for]/text()")
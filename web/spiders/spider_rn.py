@@ -1,11 +1,12 @@
+import asyncio
 import datetime
-import io
 import os
 import re
 
-import rows
 import scrapy
 
+from covid19br.pdf import get_extractor
+
 from .base import BaseCovid19Spider
 
 
@@ -20,6 +21,44 @@ def convert_city(city):
         return city
 
 
+def extract_bulletin(document):
+    """Extract date, confirmed and deaths per city (runs in the PDF extractor pool)"""
+    date = None
+    for page in document.text_objects(starts_after=re.compile("EM INVESTIGAÇÃO.*")):
+        for obj in page:
+            if "Dados extraídos" in obj.text:
+                day, month, year = re.compile("([0-9]{2})/([0-9]{2})/([0-9]{4})").findall(obj.text)[0]
+                date = datetime.date(int(year), int(month), int(day))
+                break
+        if date is not None:
+            break
+
+    table = document.table(
+        starts_after=re.compile("DADOS DETALHADOS POR MUNICÍPIO DE RESIDÊNCIA.*"), ends_before=re.compile("Fonte:"),
+    )
+    confirmed_cases = {}
+    for row in table:
+        city = convert_city(row.municipio_de_residencia)
+        if city is None:
+            continue
+        confirmed = row.casos_confirmados_incidencia_por_n_100_ooo_hab.splitlines()[0]
+        if confirmed in ("-", ""):
+            confirmed = None
+        else:
+            confirmed = int(confirmed)
+        confirmed_cases[city] = confirmed
+
+    table = document.table(starts_after=re.compile("EM INVESTIGAÇÃO.*"), ends_before=re.compile("Fonte:"))
+    deaths_cases = {}
+    for row in table:
+        city = convert_city(row.field_0)
+        if city is None:
+            continue
+        deaths_cases[city] = int(row.confirmado)
+
+    return date, confirmed_cases, deaths_cases
+
+
 class Covid19RNSpider(BaseCovid19Spider):
     http_proxy = os.environ.get("HTTP_PROXY", None)
     name = "RN"
@@ -30,47 +69,15 @@ class Covid19RNSpider(BaseCovid19Spider):
             url=response.xpath("//a[contains(@href, 'PDF')]/@href")[0].extract(), callback=self.parse_pdf,
         )
 
-    def parse_pdf(self, response):
-        pdf = rows.plugins.pdf.PyMuPDFBackend(io.BytesIO(response.body))
-        pages = pdf.text_objects(starts_after=re.compile("EM INVESTIGAÇÃO.*"))
-        found = False
-        for page in pages:
-            for obj in page:
-                if "Dados extraídos" in obj.text:
-                    day, month, year = re.compile("([0-9]{2})/([0-9]{2})/([0-9]{4})").findall(obj.text)[0]
-                    date = datetime.date(int(year), int(month), int(day))
-                    found = True
-                    break
-            if found:
-                break
-        self.add_report(date=date, url=response.url)
+    async def parse_pdf(self, response):
+        # The PDF is parsed in the extractor's process pool, without
+        # blocking the reactor while waiting for it.
+        result = await asyncio.wrap_future(get_extractor().submit(extract_bulletin, response.body))
+        self.add_bulletin_data(result, response.url)
 
-        table = rows.import_from_pdf(
-            io.BytesIO(response.body),
-            starts_after=re.compile("DADOS DETALHADOS POR MUNICÍPIO DE RESIDÊNCIA.*"),
-            ends_before=re.compile("Fonte:"),
-        )
-        confirmed_cases = {}
-        for row in table:
-            city = convert_city(row.municipio_de_residencia)
-            if city is None:
-                continue
-            confirmed = row.casos_confirmados_incidencia_por_n_100_ooo_hab.splitlines()[0]
-            if confirmed in ("-", ""):
-                confirmed = None
-            else:
-                confirmed = int(confirmed)
-            confirmed_cases[city] = confirmed
-
-        table = rows.import_from_pdf(
-            io.BytesIO(response.body), starts_after=re.compile("EM INVESTIGAÇÃO.*"), ends_before=re.compile("Fonte:"),
-        )
-        deaths_cases = {}
-        for row in table:
-            city = convert_city(row.field_0)
-            if city is None:
-                continue
-            deaths_cases[city] = int(row.confirmado)
+    def add_bulletin_data(self, result, url):
+        date, confirmed_cases, deaths_cases = result
+        self.add_report(date=date, url=url)
 
         cities = set(confirmed_cases.keys()) | set(deaths_cases.keys())
         for city in cities: